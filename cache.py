@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of parsed observation files for long-running services.
+
+Parsed files are kept as array-mode RinexObservation objects (see
+ObsArrays), keyed by path, size, modification time and selectors, and
+evicted least recently used first once their arrays exceed a byte budget.
+
+With a *shared_dir* on a memory file system (e.g. /dev/shm), the arrays of
+a parsed file are also written there and memory-mapped back, so that all
+the worker processes of a prefork server map the same pages instead of
+holding one copy each. The shared directory is bounded as well: on every
+cache miss, copies of files that changed or disappeared are removed, then
+the least recently used copies until the rest fits in *shared_bytes*.
+Copies are renamed to a hidden name before removal and list the systems
+they hold, so a copy caught half removed is never taken as complete.
+Hidden entries older than STALE_SECONDS are left over by failed processes
+and removed too.
+Removing a copy does not disturb processes that have it mapped.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from rinexobs import RinexObservation, ObsHeader
+from obs import Observations
+from obsarray import ObsArrays
+
+# Age (s) after which hidden entries of the shared directory (copies being
+# written or removed) are taken as left over by a failed process.
+STALE_SECONDS = 3600
+
+class ObservationCache:
+    """
+    LRU cache of parsed observation files, bounded by array memory.
+    """
+
+    def __init__(self, max_bytes = 512*2**20, shared_dir = None,
+                 shared_bytes = None):
+        """
+        *max_bytes* is the memory budget of the cached arrays; *shared_dir*
+        an optional directory to share arrays between processes, holding at
+        most *shared_bytes* (default *max_bytes*).
+        """
+        self.max_bytes = max_bytes
+        self.shared_dir = shared_dir
+        self.shared_bytes = shared_bytes if shared_bytes is not None else max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if shared_dir is not None and not os.path.isdir(shared_dir):
+            os.makedirs(shared_dir)
+
+    def key(self, filename, systems = None, dtype = 'float64'):
+        """
+        Return the cache key of *filename* read with the given selectors.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        if systems is not None:
+            systems = ''.join(sorted(systems))
+        return (path, st.st_size, st.st_mtime, systems, dtype)
+
+    def get(self, filename, systems = None, dtype = 'float64'):
+        """
+        Return the RinexObservation of *filename* in array mode (see
+        RinexObservation), restricted to *systems* (e.g. 'GE') if given, with
+        values stored as *dtype*. The file is parsed only when it is not
+        cached or has changed on disk. Returned objects are shared: do not
+        modify them.
+        """
+        key = self.key(filename, systems, dtype)
+        with self._lock:
+            if key in self.entries:
+                obs, size = self.entries.pop(key)
+                self.entries[key] = (obs, size)
+                self.hits += 1
+                return obs
+            self.misses += 1
+        obs = self._load(key)
+        size = obs.arrays.nbytes()
+        with self._lock:
+            if key not in self.entries:
+                self.entries[key] = (obs, size)
+                self.size += size
+                self._evict()
+        return obs
+
+    def _evict(self):
+        """
+        Drop least recently used entries until the budget is met; the most
+        recent entry is always kept.
+        """
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key, (obs, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def clear(self):
+        """
+        Empty the cache.
+        """
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _load(self, key):
+        """
+        Return the observation object of *key*, from the shared directory if
+        another process already parsed it.
+        """
+        path, size, mtime, systems, dtype = key
+        if self.shared_dir is None:
+            return _select(self._parse(path, dtype), systems)
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        directory = os.path.join(self.shared_dir, name)
+        try:
+            obs = _mapped(path, directory)
+            os.utime(directory, None)
+        except (IOError, OSError):
+            # not published yet, or removed meanwhile by another process;
+            # make room for the new copy first
+            self._prune(directory)
+            obs = self._publish(key, directory)
+        self._prune(directory)
+        return obs
+
+    def _publish(self, key, directory):
+        """
+        Parse the file of *key* and publish its arrays in *directory*. A
+        failed write (e.g. a full file system) leaves nothing behind.
+        """
+        path, size, mtime, systems, dtype = key
+        obs = _select(self._parse(path, dtype), systems)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.shared_dir)
+        try:
+            f = open(os.path.join(tmp, 'header'), 'w')
+            try:
+                f.write('\n'.join(obs.headerlines))
+            finally:
+                f.close()
+            f = open(os.path.join(tmp, 'key'), 'w')
+            try:
+                f.write('%s\n%d\n%r\n%s\n' % (path, size, mtime,
+                                              ''.join(sorted(obs.arrays.keys()))))
+            finally:
+                f.close()
+            obs.arrays.save(tmp)
+        except (IOError, OSError):
+            shutil.rmtree(tmp, True)
+            raise
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # another process published it first
+            shutil.rmtree(tmp, True)
+        try:
+            mapped = _mapped(path, directory)
+        except (IOError, OSError):
+            # removed meanwhile by another process
+            return obs
+        obs.arrays.close()
+        return mapped
+
+    def _prune(self, keep = None):
+        """
+        Remove the shared copies of files that changed or disappeared, then
+        the least recently used ones until the rest fits in *shared_bytes*,
+        and stale hidden entries. The directory *keep* (in use by this call)
+        is never removed.
+        """
+        entries = [ ]
+        now = time.time()
+        for name in os.listdir(self.shared_dir):
+            directory = os.path.join(self.shared_dir, name)
+            if name.startswith('.'):
+                try:
+                    if now - os.stat(directory).st_mtime > STALE_SECONDS:
+                        shutil.rmtree(directory, True)
+                except OSError:
+                    pass
+                continue
+            try:
+                f = open(os.path.join(directory, 'key'), 'r')
+                try:
+                    path, size, mtime = f.read().split('\n')[:3]
+                finally:
+                    f.close()
+                used = os.stat(directory).st_mtime
+                nbytes = sum([ os.path.getsize(os.path.join(directory, n))
+                               for n in os.listdir(directory) ])
+            except (IOError, OSError, ValueError):
+                continue
+            if directory != keep and _changed(path, int(size), float(mtime)):
+                _remove(directory)
+                continue
+            entries.append((used, nbytes, directory))
+        entries.sort()
+        total = sum([ e[1] for e in entries ])
+        for used, nbytes, directory in entries:
+            if total <= self.shared_bytes:
+                break
+            if directory != keep:
+                _remove(directory)
+                total -= nbytes
+
+    def _parse(self, path, dtype):
+        """
+        Parse *path* into array mode; the budget bounds its memory too.
+        """
+        return RinexObservation(path, arrays=True, dtype=dtype,
+                                max_memory=self.max_bytes)
+
+def _select(obs, systems):
+    """
+    Keep only *systems* in the arrays of *obs*.
+    """
+    if systems is not None:
+        arrays = obs.arrays
+        obs.arrays = ObsArrays(dict([ (s, arrays[s]) for s in arrays.keys()
+                                      if s in systems ]), arrays.spilldir)
+        arrays.spilldir = None
+    return obs
+
+def _changed(path, size, mtime):
+    """
+    Return True if file *path* no longer has *size* and *mtime*.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return True
+    return st.st_size != size or st.st_mtime != mtime
+
+def _remove(directory):
+    """
+    Remove the shared copy *directory*. It is renamed to a hidden name first,
+    so it disappears at once for other processes; if that fails another
+    process is already removing it.
+    """
+    head, name = os.path.split(directory)
+    hidden = os.path.join(head, '.old-%s-%d' % (name, os.getpid()))
+    try:
+        os.rename(directory, hidden)
+    except OSError:
+        return
+    shutil.rmtree(hidden, True)
+
+def _mapped(path, directory):
+    """
+    Return a RinexObservation for *path* whose arrays are memory-mapped from
+    the shared *directory*. Raise IOError if the copy is incomplete.
+    """
+    f = open(os.path.join(directory, 'key'), 'r')
+    try:
+        systems = f.read().split('\n')[3]
+    finally:
+        f.close()
+    f = open(os.path.join(directory, 'header'), 'r')
+    try:
+        headerlines = f.read().split('\n')
+    finally:
+        f.close()
+    obs = RinexObservation()
+    obs.filename = path
+    obs.lines = [ ]
+    obs.headerlines = headerlines
+    obs.header = ObsHeader(headerlines)
+    obs.qc = None
+    obs.observations = Observations([ ])
+    obs.arrays = ObsArrays.load(directory, obs.header.ObsTypes,
+                                obs.header.GlonassSlots)
+    if ''.join(sorted(obs.arrays.keys())) != systems:
+        raise IOError('incomplete shared copy %s' % directory)
+    return obs
+
+_cache = None
+
+def getObservation(filename, systems = None, dtype = 'float64'):
+    """
+    Return *filename* from the process-wide ObservationCache (see
+    ObservationCache.get), created with default settings on first use;
+    call setCache() beforehand to configure it.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ObservationCache()
+    return _cache.get(filename, systems, dtype)
+
+def setCache(cache):
+    """
+    Install *cache* as the process-wide ObservationCache.
+    """
+    global _cache
+    _cache = cache
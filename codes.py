@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Compact integer codes for observation types and satellites.
+
+Every (system, observation type, band, attribute) combination and every
+satellite (system, prn) has a small integer code. Codes are computed from
+the fields, not assigned in order of appearance, so they are the same in
+every process and can be stored in arrays and files. The lookup tables are
+built once; both directions are O(1).
+
+Observation codes fit in int16, satellite codes (system index * 100 + prn)
+too, so they can be used as numpy columns and grouped by directly.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+# The order and size of these tables define the codes. Only SYSTEMS, the
+# outermost factor of observation and satellite codes, may be appended to;
+# any change to KINDS, ATTRIBUTES or BANDS renumbers every code.
+SYSTEMS = 'GRESCJI'
+KINDS = 'CLDSX'
+ATTRIBUTES = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+BANDS = 10
+
+NUM_OBSCODES = len(SYSTEMS)*len(KINDS)*BANDS*len(ATTRIBUTES)
+NUM_SATCODES = len(SYSTEMS)*100
+
+_obsnames = [ s + k + str(b) + a for s in SYSTEMS for k in KINDS
+              for b in range(BANDS) for a in ATTRIBUTES ]
+_obscodes = dict([ (n, i) for i, n in enumerate(_obsnames) ])
+_obstypes = { }
+_satnames = [ '%s%02d' % (s, p) for s in SYSTEMS for p in range(100) ]
+_satcodes = dict([ (n, i) for i, n in enumerate(_satnames) ])
+_sysindex = dict([ (s, i) for i, s in enumerate(SYSTEMS) ])
+_kindindex = dict([ (k, i) for i, k in enumerate(KINDS) ])
+_attrindex = dict([ (a, i) for i, a in enumerate(ATTRIBUTES) ])
+
+def typeCode(system, kind, band, attribute):
+    """
+    Return the code of an observation type given by its fields (see ObsType).
+    Raise ValueError for unknown types.
+    """
+    try:
+        return (((_sysindex[system]*len(KINDS) + _kindindex[kind])*BANDS +
+                 int(band))*len(ATTRIBUTES) + _attrindex[attribute])
+    except KeyError:
+        raise ValueError('unknown observation type %s%s%s%s' %
+                         (system, kind, band, attribute))
+
+def obsCode(obstype, system = None):
+    """
+    Return the code of *obstype*, an ObsType or its text ('GL1C', or 'L1C'
+    with *system*). Raise ValueError for unknown types.
+    """
+    if not isinstance(obstype, basestring):
+        return obstype.Code()
+    if len(obstype) == 3 and system is not None:
+        obstype = system + obstype
+    try:
+        return _obscodes[obstype]
+    except KeyError:
+        raise ValueError('unknown observation type %s' % obstype)
+
+def obsName(code):
+    """
+    Return the text of observation *code*, e.g. 'GL1C'.
+    """
+    return _obsnames[code]
+
+def obsType(code):
+    """
+    Return the ObsType of *code*; the same object is returned for the same
+    code, so it must not be modified.
+    """
+    try:
+        return _obstypes[code]
+    except KeyError:
+        from obs import ObsType
+        return _obstypes.setdefault(code, ObsType(_obsnames[code]))
+
+def satCode(system, prn):
+    """
+    Return the code of satellite *prn* of *system*.
+    """
+    try:
+        return _sysindex[system]*100 + int(prn)
+    except KeyError:
+        raise ValueError('unknown satellite system %s' % system)
+
+def satCodes(system, prn):
+    """
+    Return the int16 codes of an array of *prn* of *system*.
+    """
+    return (satCode(system, 0) + np.asarray(prn)).astype(np.int16)
+
+def satName(code):
+    """
+    Return the text of satellite *code*, e.g. 'G05'.
+    """
+    return _satnames[code]
+
+def satFromName(name):
+    """
+    Return the code of satellite text *name* ('G05', 'G 5' or 'G5').
+    """
+    name = name.strip()
+    try:
+        return _satcodes[name]
+    except KeyError:
+        return satCode(name[0], name[1:].strip() or 0)
+
+def satSystem(code):
+    """
+    Return the system letter of satellite *code*.
+    """
+    return SYSTEMS[code // 100]
+
+def satPrn(code):
+    """
+    Return the PRN of satellite *code*.
+    """
+    return code % 100
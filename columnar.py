@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Partitioned columnar (Parquet or Feather/Arrow IPC) storage of observations.
+
+Datasets are directory trees partitioned by station, date and system:
+
+    root/station=<name>/date=<yyyy-mm-dd>/system=<letter>/part-<id>.parquet
+
+Each part holds the columns time (GPS seconds), prn, sat (satellite code,
+see codes.py) and flag, then for every observation type (e.g. 'L1C') the
+value and its '<type>_lli' and '<type>_ssi' flags. Every write becomes one
+Parquet row group (or Arrow record batch). Only Parquet row groups carry
+min/max statistics, which let readers skip those outside a time range;
+Arrow files are memory-mapped and filtered after reading. Exports always
+add new parts, so datasets can be appended to at any time.
+
+Needs the optional pyarrow package.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import os
+import re
+import uuid
+from datetime import timedelta
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from rinex import readheader
+from rinexobs import ObsHeader
+from epochblock import iterEpochBlocks
+from obsarray import ArrayBuilder, SystemArrays
+from qc import GPSZERO
+from codes import obsCode, obsType
+
+FORMATS = {'parquet': '.parquet', 'feather': '.arrow'}
+
+def _require():
+    if pa is None:
+        raise ImportError('pyarrow is needed for columnar storage.')
+
+def _daystr(day):
+    """
+    Return the date of GPS day number *day* (days since GPS time zero).
+    """
+    return (GPSZERO + timedelta(days=int(day))).strftime('%Y-%m-%d')
+
+def _partvalue(name):
+    """
+    Return *name* usable as a partition value.
+    """
+    return re.sub('[^A-Za-z0-9_.-]', '_', name.strip()) or 'unknown'
+
+def _numpy(column):
+    """
+    Return a pyarrow (chunked) *column* as a numpy array, nulls as NaN.
+    """
+    chunks = getattr(column, 'chunks', [ column ])
+    if not chunks:
+        return np.zeros(0, dtype=column.type.to_pandas_dtype())
+    return np.concatenate([ c.to_numpy(zero_copy_only=False) for c in chunks ])
+
+def toTable(sa, rows = None):
+    """
+    Return *rows* (index array, default all) of SystemArrays *sa* as a
+    pyarrow Table; blank values become nulls.
+    """
+    _require()
+    if rows is None:
+        rows = np.arange(len(sa))
+    names = [ 'time', 'prn', 'sat', 'flag' ]
+    cols = [ pa.array(sa.time[rows]), pa.array(sa.prn[rows]),
+             pa.array(sa.satellites()[rows]), pa.array(sa.flag[rows]) ]
+    for j, t in enumerate(sa.obstypes):
+        v = sa.getValues(j)[rows]
+        code = t.ToStr()
+        names.extend([ code, code + '_lli', code + '_ssi' ])
+        cols.extend([ pa.array(v, mask=np.isnan(v)),
+                      pa.array(sa.lli[rows, j]), pa.array(sa.ssi[rows, j]) ])
+    return pa.Table.from_arrays(cols, names)
+
+def tableToArrays(system, table):
+    """
+    Return the SystemArrays of a pyarrow *table* of *system* read back from
+    a dataset; flags of codes whose flag columns were not read are 0.
+    """
+    names = table.column_names
+    codes = [ n for n in names if _isobs(system, n) ]
+    n = table.num_rows
+    get = lambda name: _numpy(table.column(name)) if name in names else None
+    values = np.full((n, len(codes)), np.nan)
+    lli = np.zeros((n, len(codes)), dtype=np.int8)
+    ssi = np.zeros((n, len(codes)), dtype=np.int8)
+    for j, c in enumerate(codes):
+        values[:, j] = get(c)
+        if c + '_lli' in names:
+            lli[:, j] = get(c + '_lli')
+        if c + '_ssi' in names:
+            ssi[:, j] = get(c + '_ssi')
+    time = get('time')
+    prn = get('prn')
+    flag = get('flag')
+    return SystemArrays(system, [ obsType(obsCode(c, system)) for c in codes ],
+        time if time is not None else np.zeros(n),
+        prn.astype(np.int8) if prn is not None else np.zeros(n, dtype=np.int8),
+        flag.astype(np.int8) if flag is not None else np.zeros(n, dtype=np.int8),
+        values, lli, ssi)
+
+def _isobs(system, name):
+    """
+    Return True if column *name* holds the values of an observation type.
+    """
+    try:
+        obsCode(name, system)
+    except ValueError:
+        return False
+    return len(name) == 3
+
+class ColumnarWriter:
+    """
+    Streaming writer of a partitioned dataset. Partition files stay open
+    until close(), each write() adds one row group to them.
+    """
+
+    def __init__(self, root, station, format = 'parquet'):
+        """
+        Write parts for *station* under directory *root*; *format* is
+        'parquet' or 'feather'.
+        """
+        _require()
+        if format not in FORMATS:
+            raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+        self.root = root
+        self.station = _partvalue(station)
+        self.format = format
+        self.writers = { }
+
+    def write(self, sa):
+        """
+        Append the rows of SystemArrays *sa* to their date partitions.
+        """
+        if len(sa) == 0:
+            return
+        day = np.floor(np.asarray(sa.time) / 86400.0)
+        for d in np.unique(day):
+            rows = np.nonzero(day == d)[0]
+            table = toTable(sa, rows)
+            self._writer((_daystr(d), sa.system), table.schema).write(table)
+
+    def _writer(self, key, schema):
+        """
+        Return the open writer of partition *key* (date, system).
+        """
+        if key not in self.writers:
+            directory = os.path.join(self.root, 'station=%s' % self.station,
+                                     'date=%s' % key[0], 'system=%s' % key[1])
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, 'part-%s%s' % (uuid.uuid4().hex,
+                                                        FORMATS[self.format]))
+            if self.format == 'parquet':
+                self.writers[key] = _ParquetPart(path, schema)
+            else:
+                self.writers[key] = _ArrowPart(path, schema)
+        return self.writers[key]
+
+    def close(self):
+        """
+        Close all partition files.
+        """
+        for key in self.writers:
+            self.writers[key].close()
+        self.writers = { }
+
+class _ParquetPart:
+    def __init__(self, path, schema):
+        self.writer = pq.ParquetWriter(path, schema)
+    def write(self, table):
+        self.writer.write_table(table)
+    def close(self):
+        self.writer.close()
+
+class _ArrowPart:
+    def __init__(self, path, schema):
+        self.sink = pa.OSFile(path, 'wb')
+        self.writer = pa.RecordBatchFileWriter(self.sink, schema)
+    def write(self, table):
+        for batch in table.to_batches():
+            self.writer.write_batch(batch)
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+def exportObservation(obs, root, format = 'parquet', station = None):
+    """
+    Export RinexObservation *obs* to the dataset *root* (see
+    RinexObservation.getArrays). *station* defaults to the marker name.
+    """
+    if station is None:
+        station = getattr(obs.header, 'MarkerName', 'unknown')
+    writer = ColumnarWriter(root, station, format)
+    try:
+        arrays = obs.getArrays()
+        for s in arrays.keys():
+            writer.write(arrays[s])
+    finally:
+        writer.close()
+
+def exportFile(filename, root, format = 'parquet', station = None,
+               chunk = 3600):
+    """
+    Stream the observation file *filename* into the dataset *root*, *chunk*
+    epochs at a time, so the file is never held in memory.
+    """
+    f = open(filename, 'r')
+    try:
+        header = ObsHeader(readheader(f))
+        if station is None:
+            station = getattr(header, 'MarkerName', 'unknown')
+        writer = ColumnarWriter(root, station, format)
+        try:
+            builder = None
+            n = 0
+            for block in iterEpochBlocks(f):
+                if builder is None:
+                    builder = ArrayBuilder(header.ObsTypes, header.GlonassSlots)
+                builder.addBlock(block)
+                n += 1
+                if n % chunk == 0:
+                    _flush(writer, builder)
+                    builder = None
+            if builder is not None:
+                _flush(writer, builder)
+        finally:
+            writer.close()
+    finally:
+        f.close()
+
+def _flush(writer, builder):
+    arrays = builder.finish()
+    for s in arrays.keys():
+        writer.write(arrays[s])
+
+def partitions(root, station = None, date = None, system = None):
+    """
+    Return the (station, date, system, directory) partitions of dataset
+    *root* matching the criteria: each one value or a list of values; *date*
+    may also be a (first, last) tuple of 'yyyy-mm-dd' strings.
+    """
+    def match(value, wanted):
+        if wanted is None:
+            return True
+        if isinstance(wanted, tuple):
+            return wanted[0] <= value <= wanted[1]
+        if isinstance(wanted, list):
+            return value in wanted
+        return value == wanted
+    ret = [ ]
+    for st in sorted(os.listdir(root)):
+        if not st.startswith('station=') or not match(st[8:], station):
+            continue
+        for d in sorted(os.listdir(os.path.join(root, st))):
+            if not d.startswith('date=') or not match(d[5:], date):
+                continue
+            for sy in sorted(os.listdir(os.path.join(root, st, d))):
+                if sy.startswith('system=') and match(sy[7:], system):
+                    ret.append((st[8:], d[5:], sy[7:],
+                                os.path.join(root, st, d, sy)))
+    return ret
+
+def readColumnar(root, columns = None, station = None, date = None,
+                 system = None, start = None, end = None):
+    """
+    Read dataset *root*, only the partitions matching *station*, *date* and
+    *system* (see partitions) and only *columns* (e.g. ['L1C', 'S1C'];
+    time and prn are always read). Row groups entirely outside *start* -
+    *end* (GPS seconds) are skipped using their statistics; remaining rows
+    are filtered exactly.
+    Return {system: pyarrow Table}, see tableToArrays.
+    """
+    _require()
+    lo = -np.inf if start is None else start
+    hi = np.inf if end is None else end
+    parts = { }
+    for st, d, sy, directory in partitions(root, station, date, system):
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith('.parquet'):
+                tables = _readParquet(path, columns, lo, hi)
+            elif name.endswith('.arrow'):
+                tables = _readArrow(path, columns)
+            else:
+                continue
+            for t in tables:
+                time = _numpy(t.column('time'))
+                keep = (time >= lo) & (time <= hi)
+                if not keep.all():
+                    t = _take(t, np.nonzero(keep)[0])
+                if t.num_rows:
+                    parts.setdefault(sy, [ ]).append(t)
+    ret = { }
+    for sy in parts:
+        ret[sy] = pa.concat_tables(parts[sy])
+    return ret
+
+def _wanted(names, columns):
+    if columns is None:
+        return names
+    return [ n for n in names if n in ('time', 'prn') or n in columns ]
+
+def _readParquet(path, columns, lo, hi):
+    """
+    Return the row groups of Parquet file *path* that may hold times in
+    [*lo*, *hi*], read with the wanted columns only.
+    """
+    f = pq.ParquetFile(path)
+    names = f.schema.names
+    tcol = names.index('time')
+    ret = [ ]
+    for i in range(f.num_row_groups):
+        stats = f.metadata.row_group(i).column(tcol).statistics
+        if stats is not None and stats.has_min_max and \
+                (stats.max < lo or stats.min > hi):
+            continue
+        ret.append(f.read_row_group(i, columns=_wanted(names, columns)))
+    return ret
+
+def _readArrow(path, columns):
+    """
+    Return Arrow IPC file *path* as a table of the wanted columns; the
+    file is memory-mapped, so unwanted columns are not read.
+    """
+    reader = pa.RecordBatchFileReader(pa.memory_map(path, 'r'))
+    table = reader.read_all()
+    names = _wanted(table.column_names, columns)
+    return [ pa.Table.from_arrays([ table.column(n) for n in names ], names) ]
+
+def _take(table, rows):
+    """
+    Return *rows* of a pyarrow *table*.
+    """
+    cols = [ ]
+    for n in table.column_names:
+        a = _numpy(table.column(n))[rows]
+        cols.append(pa.array(a, mask=np.isnan(a) if a.dtype.kind == 'f' else None))
+    return pa.Table.from_arrays(cols, table.column_names)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized GNSS linear combinations over SystemArrays.
+
+Signals are given either as a band number (the first header observation
+type of the needed kind on that band is used) or as an observation code
+such as 'L1C'; for a code the observation kind is substituted as needed, so
+'L1C' also selects 'C1C' where a pseudorange is required.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+SPEED_OF_LIGHT = 299792458.0
+
+# Carrier frequencies (Hz) by system and Rinex3 band number.
+FREQUENCIES = {
+    'G': {1: 1575.42e6, 2: 1227.60e6, 5: 1176.45e6},
+    'E': {1: 1575.42e6, 5: 1176.45e6, 6: 1278.75e6, 7: 1207.14e6,
+          8: 1191.795e6},
+    'C': {1: 1575.42e6, 2: 1561.098e6, 5: 1176.45e6, 6: 1268.52e6,
+          7: 1207.14e6, 8: 1191.795e6},
+    'J': {1: 1575.42e6, 2: 1227.60e6, 5: 1176.45e6, 6: 1278.75e6},
+    'S': {1: 1575.42e6, 5: 1176.45e6},
+    'I': {5: 1176.45e6, 9: 2492.028e6},
+    'R': {3: 1202.025e6, 4: 1600.995e6, 6: 1248.06e6},
+}
+# GLONASS FDMA bands: (base frequency, channel spacing) in Hz.
+GLONASS_FDMA = {1: (1602.0e6, 0.5625e6), 2: (1246.0e6, 0.4375e6)}
+
+def frequency(sa, band, slots = None):
+    """
+    Return the carrier frequency of *band* for the rows of *sa*: a scalar,
+    or an array per row for GLONASS FDMA bands. *slots* is the GLONASS
+    {prn: channel} dictionary (default: the one attached to *sa*).
+    """
+    if sa.system == 'R' and band in GLONASS_FDMA:
+        if slots is None:
+            slots = sa.slots
+        if not slots:
+            raise ValueError('GLONASS frequency channels are unknown.')
+        channel = np.full(100, np.nan)
+        for prn in slots:
+            channel[prn] = slots[prn]
+        base, step = GLONASS_FDMA[band]
+        return base + step*channel[sa.prn]
+    try:
+        return FREQUENCIES[sa.system][band]
+    except KeyError:
+        raise ValueError('No frequency for band %d of system %s.' %
+                         (band, sa.system))
+
+def signal(sa, sig, kind):
+    """
+    Return (column, band) of signal *sig* (band number or code) for
+    observation *kind* in *sa*. Raise ValueError if not observed.
+    """
+    if isinstance(sig, (int, np.integer)):
+        band = sig
+        col = sa.find(kind, band)
+    else:
+        sig = sig[-3:]
+        band = int(sig[1])
+        try:
+            col = sa.index(kind + sig[1:])
+        except ValueError:
+            col = sa.find(kind, band)
+    if col is None:
+        raise ValueError('No %s observation on band %d for system %s.' %
+                         (kind, band, sa.system))
+    return col, band
+
+def _meters(sa, sig, kind, slots):
+    """
+    Return (values in meters, frequency) of *sig* for *kind* 'C' or 'L'.
+    """
+    col, band = signal(sa, sig, kind)
+    f = frequency(sa, band, slots)
+    v = sa.getValues(col)
+    if kind == 'L':
+        v = v * (SPEED_OF_LIGHT / f)
+    return v, f
+
+def ionosphereFree(sa, first, second, kind = 'L', slots = None):
+    """
+    Ionosphere-free combination of *first* and *second* signals, in meters.
+    *kind* is 'L' (carrier phase) or 'C' (pseudorange).
+    """
+    a, f1 = _meters(sa, first, kind, slots)
+    b, f2 = _meters(sa, second, kind, slots)
+    return (f1*f1*a - f2*f2*b) / (f1*f1 - f2*f2)
+
+def geometryFree(sa, first, second, kind = 'L', slots = None):
+    """
+    Geometry-free combination in meters: first - second for phase,
+    second - first for pseudorange, so both grow with the ionosphere.
+    """
+    a, f1 = _meters(sa, first, kind, slots)
+    b, f2 = _meters(sa, second, kind, slots)
+    if kind == 'C':
+        return b - a
+    return a - b
+
+def wideLane(sa, first, second, kind = 'L', slots = None):
+    """
+    Wide-lane combination (f1*a - f2*b)/(f1 - f2), in meters.
+    """
+    a, f1 = _meters(sa, first, kind, slots)
+    b, f2 = _meters(sa, second, kind, slots)
+    return (f1*a - f2*b) / (f1 - f2)
+
+def narrowLane(sa, first, second, kind = 'C', slots = None):
+    """
+    Narrow-lane combination (f1*a + f2*b)/(f1 + f2), in meters.
+    """
+    a, f1 = _meters(sa, first, kind, slots)
+    b, f2 = _meters(sa, second, kind, slots)
+    return (f1*a + f2*b) / (f1 + f2)
+
+def melbourneWubbena(sa, first, second, slots = None):
+    """
+    Melbourne-Wübbena combination (phase wide-lane minus code narrow-lane),
+    in wide-lane cycles.
+    """
+    lw = wideLane(sa, first, second, 'L', slots)
+    pn = narrowLane(sa, first, second, 'C', slots)
+    f1 = frequency(sa, signal(sa, first, 'L')[1], slots)
+    f2 = frequency(sa, signal(sa, second, 'L')[1], slots)
+    return (lw - pn) * (f1 - f2) / SPEED_OF_LIGHT
@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 """
 Epoch class container.
 """
@@ -109,5 +110,12 @@ class Epoch:
         """
         return self.GPSDay()*86400 + self.GPSSec()
 
+    def GPSSeconds(self):
+        """
+        Number of seconds elapsed from the beginning of GPS time
+        (1980-01-06 00:00:00). Handy as a monotonic numeric time tag.
+        """
+        return self.GPSWeek()*604800 + self.GPSTimeOfWeek()
+
     def Print(self):
         print(str(self))
\ No newline at end of file
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming access to Rinex3 observation epoch blocks.
+
+An epoch block is the '>' epoch record together with the records that
+follow it. Blocks are read one at a time from any iterable of lines, so a
+file object can be walked without loading it, and the observation records
+of one block can be decoded into numpy arrays in a single vectorized step.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+from epoch import Epoch
+
+# Epoch flags followed by header ("special") records instead of observations.
+SPECIAL_FLAGS = (2, 3, 4, 5)
+# Epoch flag whose records hold cycle slip counts, not observations.
+CYCLE_SLIP_FLAG = 6
+
+class EpochBlock:
+    """
+    One Rinex3 epoch: the '>' line and the records belonging to it.
+    """
+
+    def __init__(self, headline, records):
+        """
+        *headline* is the '>' epoch record, *records* the list of lines that
+        follow it (observation records or special records, see *special*).
+        """
+        self.headline = headline
+        self.records = records
+        self.flag = int(headline[31]) if headline[31:32].strip() else 0
+        self.numsat = int(headline[32:35]) if headline[32:35].strip() else 0
+        self.clockoffset = 0.0
+        if headline[41:56].strip():
+            self.clockoffset = float(headline[41:56])
+        self.special = self.flag in SPECIAL_FLAGS
+        self.cycleslip = self.flag == CYCLE_SLIP_FLAG
+        self._epoch = None
+
+    def epoch(self):
+        """
+        Return the Epoch of the block, or None if the epoch field is blank
+        (allowed for some event flags).
+        """
+        if self._epoch is None:
+            tokens = self.headline[1:29].split()
+            if len(tokens) < 6:
+                return None
+            self._epoch = Epoch(
+                year = int(tokens[0]),
+                month = int(tokens[1]),
+                day = int(tokens[2]),
+                hour = int(tokens[3]),
+                minute = int(tokens[4]),
+                second = float(tokens[5]),
+                )
+        return self._epoch
+
+    def timestamp(self):
+        """
+        Return the epoch as GPS seconds (see Epoch.GPSSeconds), None if blank.
+        """
+        e = self.epoch()
+        if e is None:
+            return None
+        return e.GPSSeconds()
+
+    def digest(self):
+        """
+        Return a hash of the block contents (epoch, flag, clock offset and
+        records, trailing blanks ignored). The announced record count is
+        left out, so it does not matter whether it was recomputed.
+        """
+        return hash((self.headline[:32].rstrip(), self.headline[35:].rstrip(),
+                     tuple([ r.rstrip() for r in self.records ])))
+
+    def decode(self, obstypes):
+        """
+        Decode the observation records of the block.
+        *obstypes* is a dictionary {system: [ObsType, ...]} as found in the
+        header. Records of systems not in *obstypes* are ignored.
+        Return a dictionary {system: (prn, values, lli, ssi)} where *prn* is
+        an int array (nsat), *values* a float64 array (nsat, ntypes) with NaN
+        for blank fields, *lli* and *ssi* int8 arrays (nsat, ntypes) with 0
+        for blank flags.
+        """
+        ret = { }
+        if self.special:
+            return ret
+        bysys = { }
+        for r in self.records:
+            if r[:1] in obstypes:
+                bysys.setdefault(r[0], [ ]).append(r)
+        for s in bysys:
+            ret[s] = decodeRecords(bysys[s], len(obstypes[s]))
+        return ret
+
+def decodeRecords(records, ntypes):
+    """
+    Vectorized decoding of observation *records* of one satellite system,
+    each holding *ntypes* observations. See EpochBlock.decode.
+    """
+    width = 3 + 16*ntypes
+    n = len(records)
+    lines = [ r.rstrip('\r\n')[:width].ljust(width) for r in records ]
+    raw = np.array(lines, dtype='S%d' % width).view('S1').reshape(n, width)
+    prn = np.ascontiguousarray(raw[:, 1:3]).view('S2').ravel()
+    prn = np.where(prn == b'  ', b'0', prn).astype(np.int32)
+    fields = raw[:, 3:].reshape(n, ntypes, 16)
+    text = np.ascontiguousarray(fields[:, :, :14]).view('S14').reshape(n, ntypes)
+    blank = np.char.strip(text) == b''
+    values = np.where(blank, b'0', text).astype(np.float64)
+    values[blank] = np.nan
+    lli = _flagdigits(fields[:, :, 14])
+    ssi = _flagdigits(fields[:, :, 15])
+    return prn, values, lli, ssi
+
+def _flagdigits(chars):
+    """
+    Convert an array of single digit characters to int8, blanks become 0.
+    """
+    d = np.ascontiguousarray(chars).view(np.uint8).astype(np.int8) - 48
+    d[(d < 0) | (d > 9)] = 0
+    return d
+
+def iterEpochBlocks(lines):
+    """
+    Yield EpochBlock objects from *lines*, the data section of a Rinex3
+    observation file (anything iterable: a list or an open file).
+    The record count of the epoch line is honoured, so special records
+    following event flags 2-5 are never mistaken for observations.
+    """
+    headline = None
+    records = [ ]
+    expected = 0
+    for l in lines:
+        l = l.rstrip('\r\n')
+        if headline is not None and len(records) < expected and \
+            (l[:1] != '>' or headline[31:32] in '2345'):
+            records.append(l)
+            continue
+        if l[:1] == '>':
+            if headline is not None:
+                yield EpochBlock(headline, records)
+            headline = l.ljust(35)
+            records = [ ]
+            expected = int(headline[32:35]) if headline[32:35].strip() else 0
+        elif headline is not None and l.strip():
+            # more records than announced; keep them with the current epoch
+            records.append(l)
+    if headline is not None:
+        yield EpochBlock(headline, records)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Receiver/satellite geometry: ECEF to geodetic and elevation/azimuth.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1.0/298.257223563
+WGS84_E2 = WGS84_F*(2.0 - WGS84_F)
+
+def ecef2geodetic(x, y, z):
+    """
+    Return (latitude, longitude, height) in radians and meters for ECEF
+    coordinates in meters (scalars or arrays).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p*(1.0 - WGS84_E2))
+    for i in range(5):
+        n = WGS84_A / np.sqrt(1.0 - WGS84_E2*np.sin(lat)**2)
+        h = p/np.cos(lat) - n
+        lat = np.arctan2(z, p*(1.0 - WGS84_E2*n/(n + h)))
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2*np.sin(lat)**2)
+    h = p/np.cos(lat) - n
+    return lat, lon, h
+
+def receiverPosition(receiver):
+    """
+    Return *receiver* as an ECEF array of 3 elements. *receiver* is a
+    sequence (x, y, z) or a header with ApproxX/Y/Z (see ObsHeader).
+    """
+    if hasattr(receiver, 'ApproxX'):
+        receiver = (receiver.ApproxX, receiver.ApproxY, receiver.ApproxZ)
+    return np.asarray(receiver, dtype=np.float64)
+
+def elevationAzimuth(receiver, satellites):
+    """
+    Return (elevation, azimuth) in degrees of *satellites* (array (n, 3) of
+    ECEF positions in meters) seen from *receiver* (see receiverPosition).
+    """
+    rx = receiverPosition(receiver)
+    lat, lon, h = ecef2geodetic(rx[0], rx[1], rx[2])
+    d = np.asarray(satellites, dtype=np.float64) - rx
+    sl, cl = np.sin(lat), np.cos(lat)
+    so, co = np.sin(lon), np.cos(lon)
+    e = -so*d[..., 0] + co*d[..., 1]
+    n = -sl*co*d[..., 0] - sl*so*d[..., 1] + cl*d[..., 2]
+    u = cl*co*d[..., 0] + cl*so*d[..., 1] + sl*d[..., 2]
+    elev = np.degrees(np.arctan2(u, np.hypot(e, n)))
+    azim = np.degrees(np.arctan2(e, n)) % 360.0
+    return elev, azim
+
+def arrayElevations(arrays, orbit, receiver):
+    """
+    Return {system: elevation per row} in degrees for the ObsArrays
+    *arrays*. *orbit* is anything with a positions(system, prn, time)
+    method (RinexNavigation, SP3); rows without orbit get NaN.
+    """
+    ret = { }
+    for s in arrays.keys():
+        sa = arrays[s]
+        xyz, clock = orbit.positions(s, sa.prn, sa.time)
+        ret[s] = elevationAzimuth(receiver, xyz)[0]
+    return ret
+
+def elevationMask(arrays, orbit, receiver, cutoff = 10.0):
+    """
+    Return {system: boolean per row}, True where the satellite of the row
+    is at or above *cutoff* degrees (see arrayElevations).
+    """
+    ret = { }
+    elev = arrayElevations(arrays, orbit, receiver)
+    for s in elev:
+        ok = ~np.isnan(elev[s])
+        ok[ok] = elev[s][ok] >= cutoff
+        ret[s] = ok
+    return ret
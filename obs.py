@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 """
 Contains Observation and Observations classes.
 """
@@ -6,6 +7,8 @@ __email__ = 'costin.gament@gmail.com'
 __license__ = 'GPL'
 
 from epoch import Epoch
+from epochblock import iterEpochBlocks
+from codes import typeCode, satCode
 
 class ObsType:
     """
@@ -42,6 +45,26 @@ class ObsType:
             (self.ObservationType==o.ObservationType) and
             (self.Band==o.Band) and (self.Attribute == o.Attribute))
     
+    def __ne__(self, o):
+        return not self == o
+    
+    def __hash__(self):
+        """
+        Hash by code (see Code), so types can be dictionary keys.
+        """
+        try:
+            return self.Code()
+        except ValueError:
+            return hash((self.SatelliteSystem, self.ObservationType,
+                         self.Band, self.Attribute))
+    
+    def Code(self):
+        """
+        Return the integer code of the type (see codes.py).
+        """
+        return typeCode(self.SatelliteSystem, self.ObservationType, self.Band,
+                        self.Attribute)
+    
     def ToStr(self):
         return self.ObservationType+str(self.Band)+self.Attribute
 
@@ -58,6 +81,7 @@ class Observation:
         self.epoch = epoch
         self.System = System
         self.Satellite = Satellite
+        self.SatelliteCode = satCode(System, Satellite)
         self.Value = Value
         self.SignalStrength = SignalStrength
         self.LossOfLock = LossOfLock
@@ -99,18 +123,22 @@ class Observations:
         """
         self.obslist = obs_list
     
-    def fromRinex(self, lines, obstypes):
+    def fromRinex(self, lines, obstypes, qc = None):
         """
         Add the lines to the observations list and look for *obstypes*
         observation types. Input format is Rinex3.
-        """
-        for l in lines:
-            if l != '':
-                if l.strip()[0] == '>':
-                    headline = l
-                else:
+        If *qc* (a QCAccumulator) is given, it is fed every epoch block
+        during the same pass.
+        """
+        for block in iterEpochBlocks(lines):
+            if qc is not None:
+                qc.addBlock(block)
+            if block.special:
+                continue
+            for l in block.records:
+                if l != '':
                     self.obslist.extend(
-                        self._lineFromRinex(headline, l, obstypes)
+                        self._lineFromRinex(block.headline, l, obstypes)
                     )
     
     def _lineFromRinex(self, obshead, obs, obstypes):
@@ -161,12 +189,8 @@ class Observations:
         """
         Return all the observations from satellite *sat*.
         """
-        r = [ ]
-        for o in self.obslist:
-            for t in o.values:
-                if o.values[t]['Satellite'] == int(sat) and o.values[t]['System'] == sys:
-                    r.append(o)
-        return r
+        code = satCode(sys, sat)
+        return [ o for o in self.obslist if o.SatelliteCode == code ]
     
     def getEpoch(self, epoch):
         """
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+Rinex3 observations held as numpy arrays, one set of arrays per system.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from codes import obsCode, obsName, satCodes
+
+# Storage types for observation values. 'float64' keeps all values in one
+# float64 array. 'float32' stores the kinds of COMPACT_KINDS (signal
+# strength, Doppler, channel numbers: about 7 significant digits at most)
+# as float32 in a separate array and keeps pseudorange and phase exact as
+# float64.
+DTYPES = ('float64', 'float32')
+COMPACT_KINDS = ('S', 'D', 'X')
+
+def splitColumns(obstypes):
+    """
+    Return the (wide, compact) lists of columns of *obstypes*, the latter
+    being the types stored as float32 by the reduced storage types.
+    """
+    compact = [ j for j, t in enumerate(obstypes)
+                if t.ObservationType in COMPACT_KINDS ]
+    wide = [ j for j in range(len(obstypes)) if j not in compact ]
+    return wide, compact
+
+class SystemArrays:
+    """
+    Observations of one satellite system. Row i holds satellite *prn[i]* at
+    epoch *time[i]* (GPS seconds, see Epoch.GPSSeconds), rows are in file
+    order. Column j of *lli* and *ssi* is observation type *obstypes[j]*,
+    and so is column j of *values* unless the 'float32' storage type split
+    the values (see DTYPES): then *values* holds the wide columns and
+    *compact* the others, see splitColumns. Read values with getValues or
+    cells. The arrays may be memory-mapped (see ArrayBuilder).
+    """
+
+    def __init__(self, system, obstypes, time, prn, flag, values, lli, ssi,
+                 slots = None, compact = None):
+        """
+        *slots* is the GLONASS {prn: frequency channel} dictionary, if any.
+        *values* are float64, NaN for blanks. *compact* is the float32 array
+        of the compact columns, if split.
+        """
+        self.system = system
+        self.obstypes = obstypes
+        self.time = time
+        self.prn = prn
+        self.flag = flag
+        self.values = values
+        self.lli = lli
+        self.ssi = ssi
+        self.slots = slots
+        self.compact = compact
+        self.layout = None
+        if compact is not None:
+            wide, narrow = splitColumns(obstypes)
+            self.layout = [ None ]*len(obstypes)
+            for k, j in enumerate(wide):
+                self.layout[j] = (False, k)
+            for k, j in enumerate(narrow):
+                self.layout[j] = (True, k)
+
+    def __len__(self):
+        return len(self.time)
+
+    def codes(self):
+        """
+        Return the int16 codes (see codes.py) of the columns.
+        """
+        return np.array([ t.Code() for t in self.obstypes ], dtype=np.int16)
+
+    def satellites(self):
+        """
+        Return the satellite code (see codes.py) of every row.
+        """
+        return satCodes(self.system, self.prn)
+
+    def index(self, obstype):
+        """
+        Return the column of *obstype*, given as ObsType, code or text ('L1C'
+        or 'GL1C'). Raise ValueError if the type is not in the data.
+        """
+        if not isinstance(obstype, (int, np.integer)):
+            obstype = obsCode(obstype, self.system)
+        columns = self.__dict__.get('_columns')
+        if columns is None:
+            columns = dict([ (t.Code(), i) for i, t in
+                             reversed(list(enumerate(self.obstypes))) ])
+            self._columns = columns
+        try:
+            return columns[obstype]
+        except KeyError:
+            raise ValueError('%s not observed for system %s' %
+                             (obsName(obstype), self.system))
+
+    def find(self, kind, band):
+        """
+        Return the column of the first observation type of *kind* ('C', 'L',
+        'D' or 'S') on *band*, or None.
+        """
+        for i, t in enumerate(self.obstypes):
+            if t.ObservationType == kind and t.Band == band:
+                return i
+        return None
+
+    def getValues(self, obstype):
+        """
+        Return the float64 values of *obstype* (see index, or a column
+        number), NaN if blank, whatever the storage type.
+        """
+        if not isinstance(obstype, (int, np.integer)):
+            obstype = self.index(obstype)
+        return self.column(slice(None), obstype)
+
+    def column(self, rows, col):
+        """
+        Return the float64 values of column *col* on *rows* (slice or index
+        array), NaN if blank.
+        """
+        if self.layout is None:
+            return np.asarray(self.values[rows, col], dtype=np.float64)
+        compact, k = self.layout[col]
+        if compact:
+            return np.asarray(self.compact[rows, k], dtype=np.float64)
+        return np.asarray(self.values[rows, k], dtype=np.float64)
+
+    def cells(self, rows, cols = None):
+        """
+        Return the float64 values of *rows* (slice or index array) and
+        *cols* (list, default all columns), NaN if blank.
+        """
+        if cols is None:
+            cols = range(len(self.obstypes))
+        if self.layout is None:
+            if isinstance(rows, slice):
+                return np.asarray(self.values[rows][:, cols], dtype=np.float64)
+            return np.asarray(self.values[np.ix_(rows, cols)], dtype=np.float64)
+        n = len(self.time[rows])
+        ret = np.empty((n, len(cols)))
+        for i, c in enumerate(cols):
+            ret[:, i] = self.column(rows, c)
+        return ret
+
+    def nbytes(self):
+        """
+        Return the memory used by the arrays.
+        """
+        arrays = [ self.time, self.prn, self.flag, self.values, self.lli,
+                   self.ssi ]
+        if self.compact is not None:
+            arrays.append(self.compact)
+        return sum([ a.nbytes for a in arrays ])
+
+    def arcs(self, maxgap = None, slips = True):
+        """
+        Split the data into continuous satellite arcs. An arc ends at a gap
+        longer than *maxgap* seconds (default 1.5 sampling intervals) and,
+        if *slips* is True, before a phase observation with the lost-lock
+        bit of its LLI set.
+        Return (order, table): *order* sorts the rows by satellite then
+        time, and each row (prn, start, end) of *table* is an arc made of
+        rows order[start:end].
+        """
+        n = len(self)
+        order = np.lexsort((self.time, self.prn))
+        if n == 0:
+            return order, np.zeros((0, 3), dtype=np.int64)
+        p = self.prn[order]
+        t = self.time[order]
+        if maxgap is None:
+            maxgap = 1.5*self.interval()
+        brk = np.ones(n, dtype=bool)
+        brk[1:] = (p[1:] != p[:-1]) | (np.diff(t) > maxgap)
+        phase = [ i for i, o in enumerate(self.obstypes)
+                  if o.ObservationType == 'L' ]
+        if slips and phase:
+            brk |= ((self.lli[order][:, phase] & 1) != 0).any(axis=1)
+        starts = np.nonzero(brk)[0]
+        ends = np.append(starts[1:], n)
+        return order, np.column_stack((p[starts], starts, ends))
+
+    def arcIds(self, maxgap = None, slips = True):
+        """
+        Return, for every row, the number of its arc in the table of arcs().
+        """
+        order, table = self.arcs(maxgap, slips)
+        ids = np.empty(len(self), dtype=np.int64)
+        ids[order] = np.repeat(np.arange(len(table)), table[:, 2] - table[:, 1])
+        return ids
+
+    def interval(self):
+        """
+        Return the sampling interval, the most frequent epoch spacing.
+        """
+        t = np.unique(self.time)
+        if len(t) < 2:
+            return np.inf
+        dt, counts = np.unique(np.diff(t), return_counts=True)
+        return dt[np.argmax(counts)]
+
+class ObsArrays:
+    """
+    Collection of SystemArrays, keyed by system letter.
+    """
+
+    def __init__(self, systems = None, spilldir = None):
+        """
+        *spilldir* is the directory of memory-mapped arrays, if any; it is
+        removed by close().
+        """
+        self.systems = systems if systems is not None else { }
+        self.spilldir = spilldir
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Remove the memory-mapped files. The arrays must not be used anymore.
+        """
+        if self.spilldir is not None:
+            shutil.rmtree(self.spilldir, True)
+            self.spilldir = None
+
+    def __getitem__(self, system):
+        return self.systems[system]
+
+    def __contains__(self, system):
+        return system in self.systems
+
+    def keys(self):
+        return sorted(self.systems.keys())
+
+    def nbytes(self):
+        """
+        Return the memory used by all arrays.
+        """
+        return sum([ self.systems[s].nbytes() for s in self.systems ])
+
+    def select(self, **criteria):
+        """
+        Return a query.Selection of these arrays narrowed by *criteria*
+        (see Selection.select), e.g. select(system='G', obs_type='L1C').
+        """
+        from query import Selection
+        return Selection(self).select(**criteria)
+
+    def save(self, directory):
+        """
+        Write the arrays to *directory* (which must exist), one .npy file per
+        system and column.
+        """
+        for s in self.systems:
+            sa = self.systems[s]
+            for name in ArrayBuilder.COLUMNS + ('compact', ):
+                if getattr(sa, name) is not None:
+                    np.save(os.path.join(directory, '%s.%s.npy' % (s, name)),
+                            getattr(sa, name))
+
+    def load(cls, directory, obstypes, slots = None, mmap_mode = 'r'):
+        """
+        Return the ObsArrays saved in *directory* by save(). *obstypes* and
+        *slots* come from the header of the file. With *mmap_mode* the
+        arrays are memory-mapped, so processes loading the same directory
+        share their pages.
+        """
+        ret = { }
+        for s in obstypes:
+            paths = [ os.path.join(directory, '%s.%s.npy' % (s, name))
+                      for name in ArrayBuilder.COLUMNS ]
+            if not os.path.exists(paths[0]):
+                continue
+            columns = [ np.load(p, mmap_mode=mmap_mode) for p in paths ]
+            columns.append(slots if s == 'R' else None)
+            compact = os.path.join(directory, '%s.compact.npy' % s)
+            if os.path.exists(compact):
+                columns.append(np.load(compact, mmap_mode=mmap_mode))
+            ret[s] = SystemArrays(s, obstypes[s], *columns)
+        return cls(ret)
+    load = classmethod(load)
+
+class ArrayBuilder:
+    """
+    Collect decoded epoch blocks and turn them into ObsArrays.
+    With a memory budget, pending rows are appended to per-column files once
+    they exceed the budget, and the result is memory-mapped from those files.
+    """
+
+    COLUMNS = ('time', 'prn', 'flag', 'values', 'lli', 'ssi')
+
+    def __init__(self, obstypes, slots = None, dtype = 'float64',
+                 max_memory = None, tmpdir = None):
+        """
+        *obstypes* is the header dictionary {system: [ObsType, ...]},
+        *slots* the GLONASS slot/frequency dictionary.
+        *dtype* is the value storage type (see DTYPES). *max_memory* is the
+        number of bytes of decoded rows kept in memory before they are
+        spilled to a temporary directory created in *tmpdir*.
+        """
+        if dtype not in DTYPES:
+            raise ValueError('dtype must be one of %s' % ', '.join(DTYPES))
+        self.obstypes = obstypes
+        self.slots = slots
+        self.dtype = dtype
+        # values are split into wide and compact columns
+        self.split = dtype != 'float64'
+        self.columns = { }
+        self.max_memory = max_memory
+        self.tmpdir = tmpdir
+        self.spilldir = None
+        self.pending = 0
+        self.parts = { }
+        self.spilled = { }
+        for s in obstypes:
+            self.parts[s] = [ ]
+            self.spilled[s] = 0
+            self.columns[s] = splitColumns(obstypes[s])
+
+    def addBlock(self, block):
+        """
+        Decode an EpochBlock and keep its arrays. Special records and cycle
+        slip records (epoch flag 6) are skipped.
+        """
+        self.addDecoded(block)
+
+    def addDecoded(self, block, decoded = None):
+        """
+        Keep the arrays of an EpochBlock already decoded into *decoded* (see
+        EpochBlock.decode, with the header types), or decode it if None.
+        """
+        if block.special or block.cycleslip:
+            return
+        t = block.timestamp()
+        if decoded is None:
+            decoded = block.decode(self.obstypes)
+        for s in decoded:
+            prn, values, lli, ssi = decoded[s]
+            n = len(prn)
+            part = (np.full(n, t, dtype=np.float64), prn.astype(np.int8),
+                    np.full(n, block.flag, dtype=np.int8))
+            if not self.split:
+                part += (values, lli, ssi)
+            else:
+                wide, compact = self.columns[s]
+                part += (values[:, wide], lli, ssi,
+                         values[:, compact].astype(np.float32))
+            self.parts[s].append(part)
+            self.pending += sum([ a.nbytes for a in part ])
+        if self.max_memory is not None and self.pending > self.max_memory:
+            self.spill()
+
+    def _merge(self, s):
+        """
+        Return the pending parts of system *s* as one array per column.
+        """
+        parts = self.parts[s]
+        return [ np.concatenate([ p[i] for p in parts ])
+                 for i in range(len(parts[0])) ]
+
+    def _path(self, s, column):
+        return os.path.join(self.spilldir, '%s.%s' % (s, column))
+
+    def spill(self):
+        """
+        Append all pending rows to the column files.
+        """
+        if self.spilldir is None:
+            self.spilldir = tempfile.mkdtemp(prefix='pyrinex-', dir=self.tmpdir)
+        for s in self.parts:
+            if not self.parts[s]:
+                continue
+            columns = self._merge(s)
+            for name, a in zip(self.COLUMNS + ('compact', ), columns):
+                f = open(self._path(s, name), 'ab')
+                try:
+                    a.tofile(f)
+                finally:
+                    f.close()
+            self.spilled[s] += len(columns[0])
+            self.parts[s] = [ ]
+        self.pending = 0
+
+    def finish(self):
+        """
+        Return the ObsArrays of everything added so far.
+        """
+        if self.spilldir is not None:
+            self.spill()
+        ret = { }
+        for s in self.parts:
+            if self.spilldir is not None:
+                n = self.spilled[s]
+                if n == 0:
+                    continue
+                ntypes = len(self.obstypes[s])
+                wide, compact = self.columns[s]
+                shapes = [ (n,), (n,), (n,), (n, ntypes), (n, ntypes),
+                           (n, ntypes) ]
+                dtypes = [ np.float64, np.int8, np.int8, np.float64, np.int8,
+                           np.int8 ]
+                names = list(self.COLUMNS)
+                if self.split:
+                    shapes[3] = (n, len(wide))
+                    shapes.append((n, len(compact)))
+                    dtypes.append(np.float32)
+                    names.append('compact')
+                columns = [ _mapfile(self._path(s, name), d, shape)
+                            for name, d, shape in zip(names, dtypes, shapes) ]
+            else:
+                if not self.parts[s]:
+                    continue
+                columns = self._merge(s)
+            compact = columns[6:]
+            columns = columns[:6] + [ self.slots if s == 'R' else None ]
+            ret[s] = SystemArrays(s, self.obstypes[s], *(columns + compact))
+        self.parts = { }
+        return ObsArrays(ret, self.spilldir)
+
+def _mapfile(path, dtype, shape):
+    """
+    Return the array of *shape* in file *path*, memory-mapped unless empty
+    (empty files cannot be mapped).
+    """
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
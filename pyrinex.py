@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 """
 Python pyrinex module.
 """
@@ -5,4 +6,6 @@ __author__ = 'Costin Gamenț'
 __email__ = 'costin.gament@gmail.com'
 __license__ = 'GPL'
 
-from rinexobs import RinexObservation
\ No newline at end of file
+from rinexobs import RinexObservation
+from rinexnav import RinexNavigation
+from sp3 import SP3
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Quality check (teqc style) of Rinex3 observation data.
+
+The QCAccumulator is fed one EpochBlock at a time while the file is parsed,
+so quality figures cost a single read. Its memory use only depends on the
+number of systems and observation types, never on the length of the file.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from epochblock import iterEpochBlocks
+from codes import satCode, satName
+
+# Rinex3 PRN fields are two digits, so per satellite tables have 100 rows.
+MAXPRN = 100
+GPSZERO = datetime(1980, 1, 6)
+
+def timestr(t):
+    """
+    Format *t* (GPS seconds, see Epoch.GPSSeconds) as a date and time.
+    """
+    if t is None:
+        return '-'
+    return (GPSZERO + timedelta(seconds=t)).strftime('%Y-%m-%d %H:%M:%S')
+
+class SystemQC:
+    """
+    Per satellite and observation type counters of one satellite system.
+    """
+
+    def __init__(self, system, obstypes):
+        """
+        *obstypes* is the header list of ObsType for *system*.
+        """
+        self.system = system
+        self.obstypes = obstypes
+        n = len(obstypes)
+        kinds = [ t.ObservationType for t in obstypes ]
+        self.phase = np.array([ k == 'L' for k in kinds ], dtype=bool)
+        self.snrtypes = np.array([ k == 'S' for k in kinds ], dtype=bool)
+        self.epochs = np.zeros(MAXPRN, dtype=np.int64)
+        self.present = np.zeros((MAXPRN, n), dtype=np.int64)
+        self.lli = np.zeros((MAXPRN, n), dtype=np.int64)
+        self.slips = np.zeros(MAXPRN, dtype=np.int64)
+        self.gaps = np.zeros(MAXPRN, dtype=np.int64)
+        self.last = np.full(MAXPRN, np.nan)
+        self.snrcount = np.zeros((MAXPRN, n), dtype=np.int64)
+        # Sums are taken around the first value of each cell, so that the
+        # variance does not suffer from cancellation.
+        self.snrshift = np.full((MAXPRN, n), np.nan)
+        self.snrsum = np.zeros((MAXPRN, n))
+        self.snrsumsq = np.zeros((MAXPRN, n))
+        self.snrmin = np.full((MAXPRN, n), np.inf)
+        self.snrmax = np.full((MAXPRN, n), -np.inf)
+
+    def update(self, t, interval, prn, values, lli, ssi):
+        """
+        Add one epoch of decoded records (see EpochBlock.decode) at GPS
+        seconds *t*. *interval* is the nominal sampling, used for gaps.
+        """
+        ok = ~np.isnan(values)
+        self.epochs[prn] += 1
+        self.present[prn] += ok
+        self.lli[prn] += (lli != 0) & ok
+        # Bit 0 of the LLI on a phase observation marks a lost lock.
+        slip = ((lli[:, self.phase] & 1) != 0).any(axis=1)
+        self.slips[prn] += slip
+        if self.snrtypes.any():
+            snr = np.where(ok & self.snrtypes, values, np.nan)
+            valid = ~np.isnan(snr)
+            shift = self.snrshift[prn]
+            shift = np.where(np.isnan(shift) & valid, snr, shift)
+            self.snrshift[prn] = shift
+            d = np.where(valid, snr - shift, 0.0)
+            self.snrcount[prn] += valid
+            self.snrsum[prn] += d
+            self.snrsumsq[prn] += d*d
+            self.snrmin[prn] = np.fmin(self.snrmin[prn], snr)
+            self.snrmax[prn] = np.fmax(self.snrmax[prn], snr)
+        if interval:
+            last = self.last[prn]
+            seen = ~np.isnan(last)
+            self.gaps[prn] += seen & (t - np.where(seen, last, t) > 1.5*interval)
+        self.last[prn] = t
+
+    def satellites(self):
+        """
+        Return the PRNs seen, sorted.
+        """
+        return np.nonzero(self.epochs)[0]
+
+    def snrstats(self, prn, col):
+        """
+        Return (mean, std, min, max) SNR of *prn* for column *col*, or None.
+        """
+        n = self.snrcount[prn, col]
+        if n == 0:
+            return None
+        d = self.snrsum[prn, col] / n
+        var = max(self.snrsumsq[prn, col] / n - d*d, 0.0)
+        return (self.snrshift[prn, col] + d, var**0.5, self.snrmin[prn, col],
+                self.snrmax[prn, col])
+
+class QCAccumulator:
+    """
+    Streaming quality check of a Rinex3 observation file.
+    """
+
+    def __init__(self, obstypes, interval = None, maxevents = 1000):
+        """
+        *obstypes* is the header dictionary {system: [ObsType, ...]}.
+        *interval* is the nominal sampling in seconds; if None the smallest
+        epoch spacing seen so far is used. At most *maxevents* gaps and
+        event epochs are kept for the report (all of them are counted).
+        """
+        self.obstypes = obstypes
+        self.interval = interval
+        self.maxevents = maxevents
+        self.systems = { }
+        for s in obstypes:
+            self.systems[s] = SystemQC(s, obstypes[s])
+        self.epochs = 0
+        self.first = None
+        self.last = None
+        self.flags = { }
+        self.events = [ ]
+        self.ngaps = 0
+        self.gaps = [ ]
+        self._mindt = None
+
+    def addBlock(self, block):
+        """
+        Account for one EpochBlock.
+        """
+        self.addDecoded(block)
+
+    def addDecoded(self, block, decoded = None):
+        """
+        Account for one EpochBlock already decoded into *decoded* (see
+        EpochBlock.decode, with the header types), or decode it if None.
+        """
+        self.flags[block.flag] = self.flags.get(block.flag, 0) + 1
+        t = block.timestamp()
+        if block.flag > 1:
+            if len(self.events) < self.maxevents:
+                self.events.append((t, block.flag))
+            return
+        self.epochs += 1
+        if self.first is None:
+            self.first = t
+        if self.last is not None:
+            dt = t - self.last
+            if dt > 0 and (self._mindt is None or dt < self._mindt):
+                self._mindt = dt
+            interval = self.getinterval()
+            if interval and dt > 1.5*interval:
+                self.ngaps += 1
+                if len(self.gaps) < self.maxevents:
+                    self.gaps.append((self.last, t))
+        self.last = t
+        if decoded is None:
+            decoded = block.decode(self.obstypes)
+        for s in decoded:
+            self.systems[s].update(t, self.getinterval(), *decoded[s])
+
+    def getinterval(self):
+        """
+        Return the nominal sampling interval.
+        """
+        if self.interval:
+            return self.interval
+        return self._mindt
+
+    def expected(self):
+        """
+        Return the number of epochs expected between first and last epoch.
+        """
+        interval = self.getinterval()
+        if not interval or self.first is None:
+            return self.epochs
+        return int(round((self.last - self.first) / interval)) + 1
+
+    def summary(self):
+        """
+        Return a dictionary of QC figures. Per satellite entries are keyed by
+        satellite code (see codes.py, satName gives e.g. 'G05') and per
+        observation type figures by the observation code (e.g. 'L1C').
+        """
+        ret = {
+            'first': self.first, 'last': self.last,
+            'interval': self.getinterval(), 'epochs': self.epochs,
+            'expected': self.expected(), 'gaps': self.ngaps,
+            'flags': dict(self.flags), 'satellites': { },
+        }
+        for s in sorted(self.systems):
+            q = self.systems[s]
+            for prn in q.satellites():
+                sat = { 'epochs': int(q.epochs[prn]), 'gaps': int(q.gaps[prn]),
+                        'slips': int(q.slips[prn]), 'completeness': { },
+                        'lli': { }, 'snr': { } }
+                for i, t in enumerate(q.obstypes):
+                    code = t.ToStr()
+                    sat['completeness'][code] = float(q.present[prn, i]) / q.epochs[prn]
+                    sat['lli'][code] = int(q.lli[prn, i])
+                    stats = q.snrstats(prn, i)
+                    if stats is not None:
+                        sat['snr'][code] = stats
+                ret['satellites'][satCode(s, prn)] = sat
+        return ret
+
+    def report(self):
+        """
+        Return the QC summary as a list of text lines.
+        """
+        r = [ ]
+        expected = self.expected()
+        r.append('First epoch    : %s' % timestr(self.first))
+        r.append('Last epoch     : %s' % timestr(self.last))
+        r.append('Interval       : %s s' % self.getinterval())
+        r.append('Epochs         : %d of %d expected (%.1f %%)' % (
+            self.epochs, expected, 100.0*self.epochs/max(expected, 1)))
+        r.append('Epoch gaps     : %d' % self.ngaps)
+        for g in self.gaps:
+            r.append('    %s - %s' % (timestr(g[0]), timestr(g[1])))
+        events = sum([ self.flags[f] for f in self.flags if f > 1 ])
+        r.append('Flagged epochs : %d' % events)
+        for e in self.events:
+            r.append('    %s flag %d' % (timestr(e[0]), e[1]))
+        for s in sorted(self.systems):
+            q = self.systems[s]
+            codes = [ t.ToStr() for t in q.obstypes ]
+            r.append('')
+            r.append('Sat  Epochs  Gaps Slips   LLI ' +
+                ' '.join([ '%6s' % c for c in codes ]))
+            for prn in q.satellites():
+                compl = 100.0*q.present[prn] / q.epochs[prn]
+                name = satName(satCode(s, prn))
+                r.append('%s %7d %5d %5d %5d ' % (name, q.epochs[prn],
+                    q.gaps[prn], q.slips[prn], q.lli[prn].sum()) +
+                    ' '.join([ '%6.1f' % c for c in compl ]))
+            cols = np.nonzero(q.snrtypes)[0]
+            if len(cols) and len(q.satellites()):
+                r.append('SNR  ' + ' '.join([ '%23s' % codes[c] for c in cols ]))
+                for prn in q.satellites():
+                    line = '%s ' % satName(satCode(s, prn))
+                    for c in cols:
+                        stats = q.snrstats(prn, c)
+                        if stats is None:
+                            line += ' %23s' % '-'
+                        else:
+                            line += ' %5.1f/%5.1f/%5.1f/%5.1f' % stats
+                    r.append(line)
+        return r
+
+def qcfile(filename):
+    """
+    Stream *filename* once and return its filled QCAccumulator, without
+    building any Observation object.
+    """
+    from rinex import readheader
+    from rinexobs import ObsHeader
+    f = open(filename, 'r')
+    try:
+        header = ObsHeader(readheader(f))
+        qc = QCAccumulator(header.ObsTypes, getattr(header, 'Interval', None))
+        for block in iterEpochBlocks(f):
+            qc.addBlock(block)
+    finally:
+        f.close()
+    return qc
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Composable selections over ObsArrays.
+
+A Selection only records, per system, which rows (a slice or an index
+array) and which observation columns are selected. Filters are evaluated as
+boolean masks over the columns they need, and chained selections narrow the
+row index further; the observation arrays themselves are never copied until
+they are read from a SystemView.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+from obsarray import SystemArrays
+from codes import obsCode
+
+def _seconds(t):
+    """
+    Return *t* (Epoch or GPS seconds) as GPS seconds.
+    """
+    if hasattr(t, 'GPSSeconds'):
+        return t.GPSSeconds()
+    return float(t)
+
+def _aslist(x):
+    """
+    Return *x* as a list (a single value becomes a one element list).
+    """
+    if isinstance(x, (list, tuple, set, np.ndarray)):
+        return list(x)
+    return [ x ]
+
+def _systems(system):
+    """
+    Return the list of system letters of *system*: a string ('G' or 'GR')
+    or a list of letters.
+    """
+    if isinstance(system, basestring):
+        return list(system)
+    return _aslist(system)
+
+def _cells(a, rows, cols):
+    """
+    Return *rows* (slice or index array) and *cols* (list or None) of the
+    2-D array *a*, reading only those cells.
+    """
+    if cols is None:
+        return a[rows]
+    if isinstance(rows, slice):
+        return a[rows][:, cols]
+    return a[np.ix_(rows, cols)]
+
+class SystemView(SystemArrays):
+    """
+    Selected rows and columns of a SystemArrays. The attributes of
+    SystemArrays are computed on access from the underlying arrays: row
+    slices give numpy views, row indices gather only the requested array;
+    *values* are always the float64 values of the selection (see
+    SystemArrays.cells). A SystemView can be used wherever a SystemArrays
+    is expected.
+    """
+
+    def __init__(self, base, rows, cols = None):
+        """
+        *base* is the SystemArrays, *rows* a slice or index array over its
+        rows and *cols* the list of its selected columns (None for all).
+        """
+        self.base = base
+        self.rows = rows
+        self.cols = cols
+        self.system = base.system
+        self.slots = base.slots
+        self.compact = None
+        self.layout = None
+        if cols is None:
+            self.obstypes = base.obstypes
+        else:
+            self.obstypes = [ base.obstypes[c] for c in cols ]
+
+    def __len__(self):
+        if isinstance(self.rows, slice):
+            start, stop, step = self.rows.indices(len(self.base))
+            return max(0, (stop - start + step - 1) // step)
+        return len(self.rows)
+
+    def _rowsof(self, a):
+        return a[self.rows]
+
+    def _cellsof(self, a):
+        return _cells(a, self.rows, self.cols)
+
+    time = property(lambda self: self._rowsof(self.base.time))
+    prn = property(lambda self: self._rowsof(self.base.prn))
+    flag = property(lambda self: self._rowsof(self.base.flag))
+    values = property(lambda self: self.base.cells(self.rows, self.cols))
+    lli = property(lambda self: self._cellsof(self.base.lli))
+    ssi = property(lambda self: self._cellsof(self.base.ssi))
+
+    def basecolumn(self, col):
+        """
+        Return the column of the underlying SystemArrays for view column *col*.
+        """
+        if self.cols is None:
+            return col
+        return self.cols[col]
+
+    def getValues(self, obstype):
+        """
+        Return the float64 values of one observation type of the view (see
+        SystemArrays.getValues); only that column is read.
+        """
+        if not isinstance(obstype, (int, np.integer)):
+            obstype = self.index(obstype)
+        return self.base.column(self.rows, self.basecolumn(obstype))
+
+    def rowindex(self):
+        """
+        Return the selected rows as an index array into the base arrays.
+        """
+        if isinstance(self.rows, slice):
+            return np.arange(*self.rows.indices(len(self.base)))
+        return self.rows
+
+class Selection:
+    """
+    Lazily selected part of an ObsArrays, see ObsArrays.select.
+    """
+
+    def __init__(self, arrays, views = None):
+        """
+        *arrays* is the ObsArrays, *views* the {system: SystemView}
+        selected so far (default: everything).
+        """
+        self.arrays = arrays
+        if views is None:
+            views = { }
+            for s in arrays.keys():
+                views[s] = SystemView(arrays[s], slice(0, len(arrays[s])))
+        self.views = views
+
+    def __getitem__(self, system):
+        return self.views[system]
+
+    def __contains__(self, system):
+        return system in self.views
+
+    def keys(self):
+        return sorted(self.views.keys())
+
+    def __len__(self):
+        return sum([ len(self.views[s]) for s in self.views ])
+
+    def select(self, system = None, prn = None, obs_type = None, start = None,
+               end = None, min_snr = None):
+        """
+        Return a new Selection narrowed by the given criteria:
+        *system* one or more system letters ('GR' or a list); *prn* one or
+        more PRNs; *obs_type* one or more observation types ('L1C', 'GL1C'
+        or codes, see codes.py), which selects columns and drops systems
+        without them; *start* and *end* (Epoch or GPS seconds) the time
+        range, end included; *min_snr* the lowest signal to noise ratio,
+        taken from the S observations matching the selected types (all S
+        observations if none is selected).
+        """
+        views = { }
+        for s in self.views:
+            v = self.views[s]
+            if system is not None and s not in _systems(system):
+                continue
+            cols = v.cols
+            if obs_type is not None:
+                cols = self._columns(v, obs_type)
+                if not cols:
+                    continue
+            rows = v.rows
+            if start is not None or end is not None:
+                rows = self._timerange(v.base, rows, start, end)
+            if prn is not None:
+                keep = np.in1d(v.base.prn[rows], _aslist(prn))
+                rows = self._narrow(v.base, rows, keep)
+            if min_snr is not None:
+                scols = self._snrcolumns(v.base, cols)
+                if not scols:
+                    continue
+                snr = v.base.cells(rows, scols)
+                valid = ~np.isnan(snr)
+                keep = valid.any(axis=1) & \
+                    (np.where(valid, snr, np.inf) >= min_snr).all(axis=1)
+                rows = self._narrow(v.base, rows, keep)
+            views[s] = SystemView(v.base, rows, cols)
+        return Selection(self.arrays, views)
+
+    def _columns(self, view, obs_type):
+        """
+        Return the base columns of *view* matching the codes *obs_type*.
+        """
+        wanted = set()
+        for code in _aslist(obs_type):
+            if isinstance(code, basestring) and len(code) == 3:
+                code = view.system + code
+            wanted.add(obsCode(code) if isinstance(code, basestring) else int(code))
+        return [ view.basecolumn(i) for i, c in enumerate(view.codes())
+                 if c in wanted ]
+
+    def _snrcolumns(self, base, cols):
+        """
+        Return the S columns of *base* that go with the selected *cols*.
+        """
+        snr = [ i for i, t in enumerate(base.obstypes)
+                if t.ObservationType == 'S' ]
+        if cols is None:
+            return snr
+        ret = [ ]
+        for c in cols:
+            t = base.obstypes[c]
+            match = [ i for i in snr if base.obstypes[i].Band == t.Band and
+                      base.obstypes[i].Attribute == t.Attribute ] or \
+                    [ i for i in snr if base.obstypes[i].Band == t.Band ]
+            ret.extend([ i for i in match[:1] if i not in ret ])
+        return ret
+
+    def _timerange(self, base, rows, start, end):
+        """
+        Narrow *rows* to the time range; a slice stays a slice when the
+        base rows are in time order.
+        """
+        lo = -np.inf if start is None else _seconds(start)
+        hi = np.inf if end is None else _seconds(end)
+        if isinstance(rows, slice) and rows.step in (None, 1) and \
+                _timesorted(base):
+            a, b = rows.start or 0, rows.stop
+            i = a + np.searchsorted(base.time[a:b], lo, 'left')
+            j = a + np.searchsorted(base.time[a:b], hi, 'right')
+            return slice(i, j)
+        t = base.time[rows]
+        return self._narrow(base, rows, (t >= lo) & (t <= hi))
+
+    def _narrow(self, base, rows, keep):
+        """
+        Return the rows of *rows* where *keep* is True, as an index array.
+        """
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(base)))
+        return rows[keep]
+
+def _timesorted(base):
+    """
+    Return True if the rows of SystemArrays *base* are in time order
+    (computed once per arrays).
+    """
+    if not hasattr(base, '_timesorted'):
+        base._timesorted = bool(len(base.time) < 2 or
+                                (np.diff(base.time) >= 0).all())
+    return base._timesorted
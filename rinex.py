@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 """
 Rinex inheritable object container.
 """
@@ -7,6 +8,20 @@ __license__ = 'GPL'
 
 import logging
 
+def readheader(fileobject):
+    """
+    Read and return the header lines of an open Rinex *fileobject*, the
+    "END OF HEADER" line excluded. The file is left positioned on the first
+    data line, so the data section can be streamed from it.
+    """
+    r = [ ]
+    for l in fileobject:
+        if 'END OF HEADER' in l[60:]:
+            return r
+        r.append(l.rstrip('\r\n'))
+    logging.error('No valid header terminator found.')
+    return r
+
 class Rinex:
     """
     Generic Rinex file class. RinexObservation and RinexNavigation are derived
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Epoch-level comparison of two Rinex3 observation files.
+
+Both files are streamed side by side. Epoch blocks with the same contents
+are recognised by their digest and skipped; only differing epochs are
+decoded and compared observation by observation.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+from rinex import readheader
+from rinexobs import ObsHeader
+from epochblock import iterEpochBlocks
+from qc import timestr
+from codes import satCode, satName, obsName
+
+class RinexDiff:
+    """
+    Differences between an old and a new Rinex3 observation file.
+    """
+
+    def __init__(self, oldtypes, newtypes, tolerance = 0.001, flags = True,
+                 maxitems = 1000):
+        """
+        *oldtypes* and *newtypes* are the header {system: [ObsType, ...]}
+        dictionaries of both files. Values differing by more than
+        *tolerance* are changed; if *flags* is True, differing LLI or signal
+        strength flags count as changes too. At most *maxitems* differences
+        are listed in *self.items* as (time, satellite code, observation
+        code, kind, old, new), see codes.py; all of them are counted.
+        """
+        self.oldtypes = oldtypes
+        self.newtypes = newtypes
+        self.tolerance = tolerance
+        self.flags = flags
+        self.maxitems = maxitems
+        self.epochs = 0
+        self.identical = 0
+        self.addedEpochs = 0
+        self.removedEpochs = 0
+        self.changedEpochs = 0
+        self.added = 0
+        self.removed = 0
+        self.changed = 0
+        self.items = [ ]
+        self.oldcodes = _codes(oldtypes)
+        self.newcodes = _codes(newtypes)
+        # Raw text comparison only makes sense with identical layouts.
+        self.samelayout = self.oldcodes == self.newcodes
+
+    def same(self):
+        """
+        Return True if no difference was found.
+        """
+        return self.added == self.removed == self.changed == 0
+
+    def addPair(self, old, new):
+        """
+        Compare two EpochBlocks of the same epoch; either may be None when
+        the epoch is missing from one file.
+        """
+        self.epochs += 1
+        if old is None:
+            self.addedEpochs += 1
+        elif new is None:
+            self.removedEpochs += 1
+        elif self.samelayout and old.digest() == new.digest():
+            self.identical += 1
+            return
+        t = (old or new).timestamp()
+        a = old.decode(self.oldtypes) if old is not None else { }
+        b = new.decode(self.newtypes) if new is not None else { }
+        if self._compare(t, a, b) and old is not None and new is not None:
+            self.changedEpochs += 1
+
+    def _compare(self, t, a, b):
+        """
+        Compare decoded epochs *a* (old) and *b* (new) at GPS seconds *t*.
+        Return True if they differ.
+        """
+        differ = False
+        for s in sorted(set(a) | set(b)):
+            ocodes = self.oldcodes.get(s, [ ])
+            ncodes = self.newcodes.get(s, [ ])
+            codes = ocodes + [ c for c in ncodes if c not in ocodes ]
+            empty = (np.zeros(0, dtype=np.int32), None, None, None)
+            pa, va, la, sa = a.get(s, empty)
+            pb, vb, lb, sb = b.get(s, empty)
+            prns = np.union1d(pa, pb)
+            shape = (len(prns), len(codes))
+            old = _align(shape, prns, pa, [ codes.index(c) for c in ocodes ],
+                         va, la, sa)
+            new = _align(shape, prns, pb, [ codes.index(c) for c in ncodes ],
+                         vb, lb, sb)
+            ino = ~np.isnan(old[0])
+            inn = ~np.isnan(new[0])
+            both = ino & inn
+            added = inn & ~ino
+            removed = ino & ~inn
+            changed = both & (np.abs(np.where(both, old[0] - new[0], 0.0)) >
+                              self.tolerance)
+            if self.flags:
+                changed |= both & ((old[1] != new[1]) | (old[2] != new[2]))
+            for kind, mask in (('added', added), ('removed', removed),
+                               ('changed', changed)):
+                n = int(mask.sum())
+                if not n:
+                    continue
+                differ = True
+                setattr(self, kind, getattr(self, kind) + n)
+                for i, j in zip(*np.nonzero(mask)):
+                    if len(self.items) >= self.maxitems:
+                        break
+                    self.items.append((t, satCode(s, prns[i]), codes[j],
+                                       kind, old[0][i, j], new[0][i, j]))
+        return differ
+
+    def report(self):
+        """
+        Return the differences as a list of text lines.
+        """
+        r = [ ]
+        r.append('Epochs compared   : %d (%d identical)' % (self.epochs, self.identical))
+        r.append('Epochs added      : %d' % self.addedEpochs)
+        r.append('Epochs removed    : %d' % self.removedEpochs)
+        r.append('Epochs changed    : %d' % self.changedEpochs)
+        r.append('Observations added/removed/changed: %d/%d/%d' % (
+            self.added, self.removed, self.changed))
+        for t, sat, code, kind, old, new in self.items:
+            r.append('%s %s %s %-7s %14.3f %14.3f' % (timestr(t), satName(sat),
+                     obsName(code)[1:], kind, old, new))
+        return r
+
+def _codes(obstypes):
+    """
+    Return {system: [observation code, ...]} of a header dictionary (see
+    codes.py).
+    """
+    ret = { }
+    for s in obstypes:
+        ret[s] = [ t.Code() for t in obstypes[s] ]
+    return ret
+
+def _align(shape, prns, prn, cols, values, lli, ssi):
+    """
+    Spread decoded *values*, *lli*, *ssi* of satellites *prn* over a table of
+    *shape* with rows *prns* and the given *cols*; missing cells are NaN/0.
+    """
+    v = np.full(shape, np.nan)
+    l = np.zeros(shape, dtype=np.int8)
+    s = np.zeros(shape, dtype=np.int8)
+    if values is not None and len(prn):
+        idx = np.ix_(np.searchsorted(prns, prn), cols)
+        v[idx] = values
+        l[idx] = lli
+        s[idx] = ssi
+    return v, l, s
+
+def _observations(f):
+    """
+    Yield (time, EpochBlock) for the observation epochs of open file *f*.
+    """
+    for block in iterEpochBlocks(f):
+        if not block.special:
+            yield round(block.timestamp(), 6), block
+
+def diffFiles(oldfile, newfile, tolerance = 0.001, flags = True, maxitems = 1000):
+    """
+    Stream *oldfile* and *newfile* side by side and return their RinexDiff.
+    Epochs are matched by time; both files must be in time order. Event
+    records (epoch flags 2-5) are not compared.
+    """
+    fa = open(oldfile, 'r')
+    fb = open(newfile, 'r')
+    try:
+        ha = ObsHeader(readheader(fa))
+        hb = ObsHeader(readheader(fb))
+        diff = RinexDiff(ha.ObsTypes, hb.ObsTypes, tolerance, flags, maxitems)
+        ia = _observations(fa)
+        ib = _observations(fb)
+        a = next(ia, None)
+        b = next(ib, None)
+        while a is not None or b is not None:
+            if b is None or (a is not None and a[0] < b[0]):
+                diff.addPair(a[1], None)
+                a = next(ia, None)
+            elif a is None or b[0] < a[0]:
+                diff.addPair(None, b[1])
+                b = next(ib, None)
+            else:
+                diff.addPair(a[1], b[1])
+                a = next(ia, None)
+                b = next(ib, None)
+    finally:
+        fa.close()
+        fb.close()
+    return diff
+
+def parse_arguments():
+    """
+    Two positional arguments: the old and the new Rinex3 observation file.
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=str, help="Reference observation file")
+    parser.add_argument("new", type=str, help="Observation file to check")
+    parser.add_argument("--tolerance", type=float, default=0.001,
+                        help="Largest accepted value difference")
+    parser.add_argument("--noflags", action="store_true",
+                        help="Ignore LLI and signal strength differences")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    import sys
+    args = parse_arguments()
+    d = diffFiles(args.old, args.new, args.tolerance, not args.noflags)
+    for l in d.report():
+        print(l)
+    sys.exit(0 if d.same() else 1)
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Module containing RinexNavigation object and broadcast orbit evaluation.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import numpy as np
+
+from rinex import Rinex
+from epoch import Epoch
+from codes import satCode, satCodes
+
+# GPS - UTC (s) from the given GPS second on (1 Jan 2006, 1 Jan 2009,
+# 1 Jul 2012, 1 Jul 2015, 1 Jan 2017).
+LEAP_SECONDS = ((820108814, 14), (914803215, 15), (1025136016, 16),
+                (1119744017, 17), (1167264018, 18))
+# BeiDou time is 14 s behind GPS time and its week 0 is GPS week 1356.
+BDT_OFFSET = 1356*604800 + 14
+
+# Gravitational constant and Earth rotation rate used by each system.
+GM = {'G': 3.986005e14, 'J': 3.986005e14, 'E': 3.986004418e14,
+      'C': 3.986004418e14}
+OMEGA_E = {'G': 7.2921151467e-5, 'J': 7.2921151467e-5,
+           'E': 7.2921151467e-5, 'C': 7.292115e-5}
+SPEED_OF_LIGHT = 299792458.0
+# PZ-90 constants for GLONASS orbit integration.
+GLO_GM = 398600.4418e9
+GLO_AE = 6378136.0
+GLO_J2 = 1.0826257e-3
+GLO_OMEGA = 7.292115e-5
+GLO_STEP = 60.0
+
+# Number of lines of an ephemeris record for each system.
+RECORD_LINES = {'G': 8, 'E': 8, 'C': 8, 'J': 8, 'I': 8, 'R': 4, 'S': 4}
+# Largest distance (s) between time and reference epoch of an ephemeris.
+MAX_AGE = {'G': 7200.0, 'J': 7200.0, 'E': 10800.0, 'C': 3600.0,
+           'R': 1800.0}
+
+KEPLER_DTYPE = np.dtype([ (n, np.float64) for n in (
+    'prn', 'toc', 'af0', 'af1', 'af2', 'iode', 'crs', 'dn', 'm0', 'cuc',
+    'e', 'cus', 'sqrta', 'toes', 'cic', 'omega0', 'cis', 'i0', 'crc',
+    'omega', 'omegadot', 'idot', 'week', 'health', 'tgd', 'toe') ])
+GLONASS_DTYPE = np.dtype([ (n, np.float64) for n in (
+    'prn', 'toe', 'taun', 'gamma', 'x', 'vx', 'ax', 'health', 'y', 'vy',
+    'ay', 'channel', 'z', 'vz', 'az') ])
+
+def leapSeconds(t):
+    """
+    Return GPS - UTC in seconds at GPS seconds *t*.
+    """
+    r = 13
+    for start, leap in LEAP_SECONDS:
+        if t >= start:
+            r = leap
+    return r
+
+def _floats(text, n):
+    """
+    Return the *n* D19.12 fields of *text* as floats (blank fields are 0).
+    """
+    r = [ ]
+    for i in range(n):
+        f = text[19*i:19*(i+1)].strip().replace('D', 'E').replace('d', 'e')
+        r.append(float(f) if f else 0.0)
+    return r
+
+class NavHeader:
+    """
+    Rinex3 navigation header elements.
+    """
+    def __init__(self, data):
+        """
+        *data* is supposed to be a list of text lines.
+        """
+        self.LeapSeconds = None
+        self.IonoCorrections = { }
+        self.TimeCorrections = { }
+        for l in data:
+            self.parseline(l[:60], l[60:])
+
+    def parseline(self, data, label):
+        """
+        Parses and adds data to Header from a Rinex line.
+        *data* is from the begging to the 60'th column;
+        *label* is from the 61's column to the end.
+        """
+        label = label.strip()
+        if label == "RINEX VERSION / TYPE":
+            self.Version = float(data[0:20])
+            self.FileType = data[20]
+            self.SatelliteSystem = data[40]
+        elif label == "PGM / RUN BY / DATE":
+            self.Program = data[0:20].strip()
+            self.FileAgency = data[20:40].strip()
+        elif label == "IONOSPHERIC CORR":
+            self.IonoCorrections[data[0:4].strip()] = [
+                float(data[5+12*i:17+12*i].replace('D', 'E'))
+                for i in range(4) if data[5+12*i:17+12*i].strip() ]
+        elif label == "TIME SYSTEM CORR":
+            self.TimeCorrections[data[0:4].strip()] = (
+                float(data[5:22].replace('D', 'E')),
+                float(data[22:38].replace('D', 'E')))
+        elif label == "LEAP SECONDS":
+            self.LeapSeconds = int(data[0:6])
+
+class RinexNavigation(Rinex):
+    """
+    Class containing a Rinex3 navigation file. Ephemerides are kept in one
+    numpy structured array per system (*self.ephemerides*): KEPLER_DTYPE for
+    GPS, Galileo, BeiDou and QZSS, GLONASS_DTYPE for GLONASS. All times are
+    GPS seconds (see Epoch.GPSSeconds).
+    """
+    def __init__(self, filename = ''):
+        """
+        If *filename* is provided, contents will be read.
+        """
+        self.header = NavHeader([ ])
+        self.ephemerides = { }
+        self._index = { }
+        self._cache = { }
+        Rinex.__init__(self, filename)
+    def _getheader(self):
+        """
+        Read header.
+        """
+        self.header = NavHeader(self.headerlines)
+    def _getcontents(self):
+        """
+        Read ephemerides.
+        """
+        records = { }
+        i = 0
+        lines = self.lines
+        while i < len(lines):
+            l = lines[i]
+            s = l[:1]
+            if s not in RECORD_LINES:
+                i += 1
+                continue
+            n = RECORD_LINES[s]
+            rec = lines[i:i+n]
+            i += n
+            if s in GM or s == 'R':
+                records.setdefault(s, [ ]).append(self._record(s, rec))
+        self.ephemerides = { }
+        for s in records:
+            dtype = GLONASS_DTYPE if s == 'R' else KEPLER_DTYPE
+            self.ephemerides[s] = np.array(records[s], dtype=dtype)
+    def _extrainit(self):
+        """
+        Reset the lookup caches for the ephemerides just read.
+        """
+        self._index = { }
+        self._cache = { }
+    def _record(self, s, rec):
+        """
+        Return the tuple of fields of one ephemeris record of system *s*.
+        """
+        head = rec[0]
+        toc = Epoch(
+            year = int(head[4:8]),
+            month = int(head[9:11]),
+            day = int(head[12:14]),
+            hour = int(head[15:17]),
+            minute = int(head[18:20]),
+            second = float(head[21:23]),
+            ).GPSSeconds()
+        v = _floats(head[23:], 3)
+        for l in rec[1:]:
+            v.extend(_floats(l[4:].ljust(76), 4))
+        prn = int(head[1:3])
+        if s == 'R':
+            # UTC reference epoch, positions in km
+            leap = self.header.LeapSeconds
+            if leap is None:
+                leap = leapSeconds(toc)
+            km = [ f*1000.0 for f in v[3:15] ]
+            return (prn, toc + leap, v[0], v[1]) + tuple(km[0:3]) + \
+                (v[6], ) + tuple(km[4:7]) + (v[10], ) + tuple(km[8:11])
+        if s == 'C':
+            toc += 14
+            toe = v[21]*604800 + v[11] + BDT_OFFSET
+        else:
+            toe = v[21]*604800 + v[11]
+        return (prn, toc) + tuple(v[0:20]) + (v[21], v[24], v[25], toe)
+    def index(self, system, healthy = True):
+        """
+        Return (keys, rows), the cached ephemeris lookup table of *system*:
+        *keys* are satellite code (see codes.py)*1e10 + reference time,
+        sorted, and *rows* the matching rows of *self.ephemerides[system]*.
+        """
+        k = (system, healthy)
+        if k not in self._index:
+            eph = self.ephemerides.get(system)
+            if eph is None:
+                return np.zeros(0), np.zeros(0, dtype=np.int64)
+            rows = np.arange(len(eph))
+            if healthy:
+                rows = rows[eph['health'] == 0]
+            keys = satCodes(system, eph['prn'][rows])*1e10 + eph['toe'][rows]
+            order = np.argsort(keys, kind='mergesort')
+            self._index[k] = (keys[order], rows[order])
+        return self._index[k]
+    def select(self, system, prn, t, healthy = True):
+        """
+        Return the rows of *self.ephemerides[system]* closest in time to each
+        (*prn*, *t*) pair (arrays or scalars), -1 where none is within
+        MAX_AGE.
+        """
+        prn, t = np.broadcast_arrays(np.asarray(prn, dtype=np.float64),
+                                     np.asarray(t, dtype=np.float64))
+        keys, rows = self.index(system, healthy)
+        ret = np.full(prn.shape, -1, dtype=np.int64)
+        if len(keys) == 0:
+            return ret
+        q = satCodes(system, prn)*1e10 + t
+        hi = np.clip(np.searchsorted(keys, q), 0, len(keys) - 1)
+        lo = np.clip(hi - 1, 0, len(keys) - 1)
+        best = np.where(np.abs(keys[lo] - q) < np.abs(keys[hi] - q), lo, hi)
+        ok = np.abs(keys[best] - q) <= MAX_AGE.get(system, 7200.0)
+        ret[ok] = rows[best[ok]]
+        return ret
+    def bestEphemeris(self, system, prn, t, healthy = True):
+        """
+        Return the best ephemeris record of satellite *system*, *prn* at GPS
+        seconds *t*, or None. Lookups are cached.
+        """
+        if system not in self.ephemerides:
+            return None
+        k = (satCode(system, prn), t, healthy)
+        if k not in self._cache:
+            if len(self._cache) > 100000:
+                self._cache.clear()
+            row = self.select(system, prn, t, healthy)
+            self._cache[k] = None if row < 0 else self.ephemerides[system][int(row)]
+        return self._cache[k]
+    def positions(self, system, prn, t, healthy = True):
+        """
+        Return (xyz, clock) for arrays (or scalars) of *prn* and GPS seconds
+        *t* of *system*: ECEF positions (n, 3) in meters and satellite clock
+        offsets in seconds, NaN where no ephemeris is available.
+        """
+        prn, t = np.broadcast_arrays(np.asarray(prn), np.asarray(t, dtype=np.float64))
+        prn = prn.ravel()
+        t = t.ravel()
+        xyz = np.full((len(t), 3), np.nan)
+        clock = np.full(len(t), np.nan)
+        if system not in self.ephemerides:
+            return xyz, clock
+        rows = self.select(system, prn, t, healthy)
+        ok = rows >= 0
+        eph = self.ephemerides[system][rows[ok]]
+        if system == 'R':
+            xyz[ok], clock[ok] = glonassOrbit(eph, t[ok])
+        else:
+            xyz[ok], clock[ok] = keplerOrbit(system, eph, t[ok])
+        return xyz, clock
+
+def keplerOrbit(system, eph, t):
+    """
+    Evaluate Keplerian broadcast ephemerides *eph* (KEPLER_DTYPE array) at
+    GPS seconds *t* (same length). Return (xyz, clock).
+    """
+    gm = GM[system]
+    we = OMEGA_E[system]
+    tk = t - eph['toe']
+    a = eph['sqrta']**2
+    n = np.sqrt(gm/a**3) + eph['dn']
+    m = eph['m0'] + n*tk
+    e = eph['e']
+    E = m
+    for i in range(10):
+        E = m + e*np.sin(E)
+    v = np.arctan2(np.sqrt(1.0 - e*e)*np.sin(E), np.cos(E) - e)
+    phi = v + eph['omega']
+    s2, c2 = np.sin(2*phi), np.cos(2*phi)
+    u = phi + eph['cus']*s2 + eph['cuc']*c2
+    r = a*(1.0 - e*np.cos(E)) + eph['crs']*s2 + eph['crc']*c2
+    inc = eph['i0'] + eph['idot']*tk + eph['cis']*s2 + eph['cic']*c2
+    xp = r*np.cos(u)
+    yp = r*np.sin(u)
+    geo = np.zeros(len(t), dtype=bool)
+    if system == 'C':
+        geo = (eph['prn'] <= 5) | (eph['prn'] >= 59)
+    omega = eph['omega0'] + (eph['omegadot'] - we)*tk - we*eph['toes']
+    omega[geo] = (eph['omega0'] + eph['omegadot']*tk - we*eph['toes'])[geo]
+    co, so, ci, si = np.cos(omega), np.sin(omega), np.cos(inc), np.sin(inc)
+    x = xp*co - yp*ci*so
+    y = xp*so + yp*ci*co
+    z = yp*si
+    if geo.any():
+        # BeiDou GEO: rotate from the inclined frame to ECEF
+        f = np.radians(-5.0)
+        yg = y*np.cos(f) + z*np.sin(f)
+        zg = -y*np.sin(f) + z*np.cos(f)
+        ang = we*tk
+        xg = x*np.cos(ang) + yg*np.sin(ang)
+        yg2 = -x*np.sin(ang) + yg*np.cos(ang)
+        x = np.where(geo, xg, x)
+        y = np.where(geo, yg2, y)
+        z = np.where(geo, zg, z)
+    dt = t - eph['toc']
+    rel = -2.0*np.sqrt(gm)/SPEED_OF_LIGHT**2 * e*eph['sqrta']*np.sin(E)
+    clock = eph['af0'] + eph['af1']*dt + eph['af2']*dt*dt + rel
+    return np.column_stack((x, y, z)), clock
+
+def _glonassAccel(pos, vel, acc):
+    """
+    PZ-90 equations of motion: return the acceleration for states (n, 3).
+    """
+    r2 = (pos*pos).sum(axis=1)
+    r = np.sqrt(r2)
+    mu = GLO_GM/(r2*r)
+    k = 1.5*GLO_J2*GLO_GM*GLO_AE**2/(r2*r2*r)
+    z2 = 5.0*pos[:, 2]**2/r2
+    a = np.empty_like(pos)
+    a[:, 0] = -mu*pos[:, 0] - k*pos[:, 0]*(1.0 - z2) + \
+        GLO_OMEGA**2*pos[:, 0] + 2.0*GLO_OMEGA*vel[:, 1]
+    a[:, 1] = -mu*pos[:, 1] - k*pos[:, 1]*(1.0 - z2) + \
+        GLO_OMEGA**2*pos[:, 1] - 2.0*GLO_OMEGA*vel[:, 0]
+    a[:, 2] = -mu*pos[:, 2] - k*pos[:, 2]*(3.0 - z2)
+    return a + acc
+
+def glonassOrbit(eph, t):
+    """
+    Integrate GLONASS ephemerides *eph* (GLONASS_DTYPE array) to GPS
+    seconds *t* with a vectorized Runge-Kutta 4. Return (xyz, clock).
+    """
+    pos = np.column_stack((eph['x'], eph['y'], eph['z']))
+    vel = np.column_stack((eph['vx'], eph['vy'], eph['vz']))
+    acc = np.column_stack((eph['ax'], eph['ay'], eph['az']))
+    dt = t - eph['toe']
+    nsteps = int(np.ceil(np.abs(dt).max()/GLO_STEP)) if len(dt) else 0
+    if nsteps:
+        h = (dt/nsteps)[:, None]
+        for i in range(nsteps):
+            k1v = _glonassAccel(pos, vel, acc)
+            k1p = vel
+            k2v = _glonassAccel(pos + 0.5*h*k1p, vel + 0.5*h*k1v, acc)
+            k2p = vel + 0.5*h*k1v
+            k3v = _glonassAccel(pos + 0.5*h*k2p, vel + 0.5*h*k2v, acc)
+            k3p = vel + 0.5*h*k2v
+            k4v = _glonassAccel(pos + h*k3p, vel + h*k3v, acc)
+            k4p = vel + h*k3v
+            pos = pos + h/6.0*(k1p + 2*k2p + 2*k3p + k4p)
+            vel = vel + h/6.0*(k1v + 2*k2v + 2*k3v + k4v)
+    clock = eph['taun'] + eph['gamma']*dt
+    return pos, clock
@@ -1,14 +1,20 @@
+# -*- coding: utf-8 -*-
 """
 Module containing RinexObservation object.
 """
 __author__ = 'Costin Gamenț'
 __email__ = 'costin.gament@gmail.com'
-__license__ = 'GPL'import logging
+__license__ = 'GPL'
+
+import logging
 
 from datetime import datetime
-from rinex import Rinex
+from rinex import Rinex, readheader
 from epoch import Epoch
 from obs import Observation, Observations, ObsType
+from qc import QCAccumulator
+from obsarray import ArrayBuilder
+from epochblock import iterEpochBlocks
 
 
 class ObsHeader:
@@ -20,6 +26,9 @@ class ObsHeader:
         *data* is supposed to be a list of text lines.
         """
         self.GPSObsTypes = [ ]
+        self.ObsTypes = { }
+        self.GlonassSlots = { }
+        self._lastsys = None
         for l in data:
             self.parseline(l[:60], l[59:])
 
@@ -33,7 +42,8 @@ class ObsHeader:
             'Observer', 'ObserverAgency', 'ReceiverNumber', 'ReceiverType',
             'ReceiverVersion', 'AntennaNumber', 'AntennaType', 'AntennaHeight',
             'AntennaEccentricityE', 'AntennaEccentricityN', 'GPSObsTypes',
-            'ApproxX', 'ApproxY', 'ApproxZ',
+            'ApproxX', 'ApproxY', 'ApproxZ', 'ObsTypes', 'Interval',
+            'GlonassSlots',
         ]
         ret = { }
         for k in keyvalues:
@@ -58,7 +68,14 @@ class ObsHeader:
             self.Program = data[0:20].strip()
             self.FileAgency = data[20:40].strip()
             tmp = data[40:].strip()
-            self.CreationDateTime = datetime.strptime(tmp, '%d-%b-%y %H:%M %Z')
+            try:
+                self.CreationDateTime = datetime.strptime(tmp, '%d-%b-%y %H:%M %Z')
+            except ValueError:
+                # Rinex3 style: yyyymmdd hhmmss zone
+                try:
+                    self.CreationDateTime = datetime.strptime(tmp[:15], '%Y%m%d %H%M%S')
+                except ValueError:
+                    self.CreationDateTime = tmp
             del tmp
         elif label == "MARKER NAME":
             self.MarkerName = data.strip()
@@ -89,12 +106,24 @@ class ObsHeader:
             self.AntennaEccentricityN = float(data[28:])
         elif label == "SYS / # / OBS TYPES":
             satsys = str(data[0])
-            obsno = int(data[3:6])
+            if satsys == ' ':
+                # continuation line of the previous system
+                satsys = self._lastsys
+            else:
+                self.ObsTypes[satsys] = [ ]
+                self._lastsys = satsys
+            for desc in data[6:].split():
+                self.ObsTypes[satsys].append( ObsType(satsys + desc) )
             if satsys == 'G':
-                desc_list = data[6:].split()
-                for i in range(0,obsno):
-                    self.GPSObsTypes.append( ObsType(desc_list[i]) )
-            del satsys, obsno
+                self.GPSObsTypes = self.ObsTypes['G']
+            del satsys
+        elif label == "GLONASS SLOT / FRQ #":
+            for i in range(4, 60, 7):
+                slot = data[i:i+7]
+                if slot.strip():
+                    self.GlonassSlots[int(slot[1:3])] = int(slot[3:7])
+        elif label == "INTERVAL":
+            self.Interval = float(data[0:10])
         elif label == 'TIME OF FIRST OBS':
             self.FirstObs = Epoch(
                 year = int(data[0:6]),
@@ -132,6 +161,47 @@ class RinexObservation(Rinex):
     """
     Class containing RINEX Observation file.
     """
+    def __init__(self, filename = '', qc = False, arrays = False,
+                 max_memory = None, dtype = 'float64', tmpdir = None):
+        """
+        If *qc* is True, quality figures are gathered while the file is
+        parsed; they are available as *self.qc* (a QCAccumulator).
+        If *arrays* is True, observations are stored as numpy arrays in
+        *self.arrays* (an ObsArrays) instead of Observation objects, with
+        values stored as *dtype* (see obsarray.DTYPES): 'float64' takes 8
+        bytes per cell, 'float32' 8 bytes for pseudorange and phase and 4
+        for the other kinds. Loss of lock and signal strength flags take 2
+        more bytes per cell in both cases.
+        *max_memory* (bytes) implies *arrays*: the file is streamed instead of
+        read at once, and decoded rows beyond the budget are spilled to
+        memory-mapped files in *tmpdir*.
+        """
+        self.qc = qc
+        self.arrays = arrays or max_memory is not None
+        self.max_memory = max_memory
+        self.dtype = dtype
+        self.tmpdir = tmpdir
+        if filename != '' and max_memory is not None:
+            self._stream(filename)
+        else:
+            Rinex.__init__(self, filename)
+    def _stream(self, filename):
+        """
+        Read *filename* without keeping its lines in memory.
+        """
+        self.filename = filename
+        self.lines = [ ]
+        f = open(filename, 'r')
+        try:
+            self.headerlines = readheader(f)
+            if len(self.headerlines) <= 0:
+                logging.error('No valid header terminator found for %s' % self.filename)
+                return None
+            self._getheader()
+            self._readcontents(f)
+        finally:
+            f.close()
+        self._extrainit()
     def _getheader(self):
         """
         Read header.
@@ -145,13 +215,53 @@ class RinexObservation(Rinex):
         """
         Read observations.
         """
+        self._readcontents(self.lines)
+    def _readcontents(self, lines):
+        """
+        Read observations from *lines*, any iterable of data lines.
+        """
+        if self.qc:
+            self.qc = QCAccumulator(self.header.ObsTypes,
+                                    getattr(self.header, 'Interval', None))
+        else:
+            self.qc = None
+        if self.arrays:
+            builder = ArrayBuilder(self.header.ObsTypes, self.header.GlonassSlots,
+                                   self.dtype, self.max_memory, self.tmpdir)
+            for block in iterEpochBlocks(lines):
+                # decode once for both consumers
+                decoded = block.decode(self.header.ObsTypes)
+                if self.qc is not None:
+                    self.qc.addDecoded(block, decoded)
+                builder.addDecoded(block, decoded)
+            self.arrays = builder.finish()
+            self.observations = Observations([ ])
+            return
+        self.arrays = None
         self.observations = Observations()
-        self.observations.fromRinex(self.lines, self.header.GPSObsTypes)
+        self.observations.fromRinex(lines, self.header.GPSObsTypes,
+                                    self.qc)
     def _extrainit(self):
         """
         Nothing to do here.
         """
         pass
+    def getArrays(self):
+        """
+        Return the observations as ObsArrays. They are built from the file
+        lines on first use if the file was not read in array mode.
+        """
+        if self.arrays is None:
+            builder = ArrayBuilder(self.header.ObsTypes, self.header.GlonassSlots)
+            for block in iterEpochBlocks(self.lines):
+                builder.addBlock(block)
+            self.arrays = builder.finish()
+        return self.arrays
+    def select(self, **criteria):
+        """
+        Return a Selection of the observations (see ObsArrays.select).
+        """
+        return self.getArrays().select(**criteria)
     def export(self, filename):
         """
         Export the Rinex object to *filename*. The format is Rinex3.
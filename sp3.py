@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Module containing SP3 precise orbit object and orbit interpolation.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import logging
+
+import numpy as np
+
+from epoch import Epoch
+from rinexnav import leapSeconds
+from codes import SYSTEMS, NUM_SATCODES, satCodes, satFromName
+
+# Bad or absent values of SP3 position (km) and clock (microseconds) fields.
+BAD_POSITION = 0.0
+BAD_CLOCK = 999999.0
+# Offset (s) to add to each SP3 time system to get GPS time; UTC and GLO
+# (UTC(SU) + GLO_OFFSET) are handled with leap seconds.
+TIME_SYSTEMS = {'GPS': 0.0, 'GAL': 0.0, 'QZS': 0.0, 'TAI': -19.0,
+                'BDT': 14.0, 'IRN': 0.0}
+GLO_OFFSET = 10800.0
+
+class SP3:
+    """
+    SP3-c/SP3-d precise orbit file. Positions are kept in *self.xyz*
+    (epochs, satellites, 3) in meters and clocks in *self.clock* (epochs,
+    satellites) in seconds, NaN where absent. *self.times* are GPS seconds
+    (see Epoch.GPSSeconds), *self.satellites* the satellite names and
+    *self.satcodes* their codes (see codes.py, -1 for unknown systems).
+    """
+
+    def __init__(self, filename = '', nodes = 10):
+        """
+        If *filename* is provided, contents will be read. *nodes* is the
+        number of epochs used by the Lagrange interpolation.
+        """
+        self.filename = filename
+        self.nodes = nodes
+        self.times = np.zeros(0)
+        self.satellites = [ ]
+        self.satcodes = np.zeros(0, dtype=np.int16)
+        self.xyz = np.zeros((0, 0, 3))
+        self.clock = np.zeros((0, 0))
+        self._weights = { }
+        # satellite code -> column
+        self._column = np.full(NUM_SATCODES, -1, dtype=np.int64)
+        if filename == '':
+            logging.debug('Starting empty SP3 file.')
+        else:
+            f = open(filename, 'r')
+            try:
+                self._read(f)
+            finally:
+                f.close()
+
+    def _read(self, lines):
+        """
+        Read SP3 *lines* (any iterable of lines).
+        """
+        self.TimeSystem = None
+        sats = [ ]
+        nsat = None
+        times = [ ]
+        records = [ ]
+        for l in lines:
+            l = l.rstrip('\r\n')
+            if l[:1] == '#' and l[1:2] in 'cdab' and l[2:3] in 'PV':
+                self.Version = l[1]
+            elif l[:2] == '##':
+                self.Interval = float(l[24:38])
+            elif l[:2] == '+ ':
+                if nsat is None:
+                    nsat = int(l[3:6])
+                for i in range(9, 60, 3):
+                    sats.append(l[i:i+3].replace(' ', '0'))
+            elif l[:2] == '%c' and self.TimeSystem is None:
+                # only the first %c line holds the time system; 'ccc' is
+                # the placeholder of files that do not give it
+                ts = l[9:12].strip()
+                self.TimeSystem = ts if ts not in ('', 'ccc') else 'GPS'
+            elif l[:1] == '*':
+                tokens = l[1:].split()
+                times.append(Epoch(
+                    year = int(tokens[0]),
+                    month = int(tokens[1]),
+                    day = int(tokens[2]),
+                    hour = int(tokens[3]),
+                    minute = int(tokens[4]),
+                    second = float(tokens[5]),
+                    ).GPSSeconds())
+            elif l[:1] == 'P' and times:
+                records.append((len(times) - 1, l[1:4].replace(' ', '0'),
+                                l[4:18], l[18:32], l[32:46], l[46:60]))
+        if self.TimeSystem is None:
+            self.TimeSystem = 'GPS'
+        self.satellites = sats[:nsat]
+        self.satcodes = np.full(len(self.satellites), -1, dtype=np.int16)
+        column = { }
+        for i, s in enumerate(self.satellites):
+            column[s] = i
+            try:
+                self.satcodes[i] = satFromName(s)
+            except ValueError:
+                pass
+        known = self.satcodes >= 0
+        self._column[:] = -1
+        self._column[self.satcodes[known]] = np.nonzero(known)[0]
+        times = np.array(times, dtype=np.float64)
+        if self.TimeSystem in ('UTC', 'GLO'):
+            if self.TimeSystem == 'GLO':
+                times -= GLO_OFFSET
+            times += [ leapSeconds(t) for t in times ]
+        elif self.TimeSystem in TIME_SYSTEMS:
+            times += TIME_SYSTEMS[self.TimeSystem]
+        else:
+            raise ValueError('unknown SP3 time system %s' % self.TimeSystem)
+        self.times = times
+        self.xyz = np.full((len(times), len(self.satellites), 3), np.nan)
+        self.clock = np.full((len(times), len(self.satellites)), np.nan)
+        if not records:
+            return
+        rec = [ r for r in records if r[1] in column ]
+        ep = np.array([ r[0] for r in rec ])
+        col = np.array([ column[r[1]] for r in rec ])
+        vals = np.array([ [ float(f) if f.strip() else np.nan for f in r[2:] ]
+                          for r in rec ])
+        pos = vals[:, 0:3]*1000.0
+        pos[(vals[:, 0:3] == BAD_POSITION).all(axis=1)] = np.nan
+        clk = vals[:, 3]*1e-6
+        clk[vals[:, 3] >= BAD_CLOCK] = np.nan
+        self.xyz[ep, col] = pos
+        self.clock[ep, col] = clk
+
+    def columns(self, system, prn):
+        """
+        Return the satellite columns of *system*/*prn* (array), -1 if absent.
+        """
+        if system not in SYSTEMS:
+            return np.full(np.shape(prn), -1, dtype=np.int64)
+        return self._column[satCodes(system, prn)]
+
+    def weights(self, start):
+        """
+        Return the barycentric Lagrange weights of the window of nodes
+        beginning at epoch *start*. Weights only depend on the node times,
+        so they are cached per window.
+        """
+        if start not in self._weights:
+            t = self.times[start:start + self.nodes]
+            t = (t - t[0]) / max(t[-1] - t[0], 1.0)
+            d = t[:, None] - t[None, :]
+            np.fill_diagonal(d, 1.0)
+            self._weights[start] = 1.0 / d.prod(axis=1)
+        return self._weights[start]
+
+    def basis(self, t):
+        """
+        Return (start, basis) for times *t*: the first node of the window of
+        each time and the Lagrange basis values (len(t), nodes). Times are
+        handled once per distinct value.
+        """
+        ne = len(self.times)
+        n = min(self.nodes, ne)
+        uniq, inverse = np.unique(t, return_inverse=True)
+        start = np.searchsorted(self.times, uniq) - n//2
+        start = np.clip(start, 0, ne - n)
+        w = np.array([ self.weights(s) for s in np.unique(start) ])
+        w = w[np.searchsorted(np.unique(start), start)]
+        node = self.times[start[:, None] + np.arange(n)]
+        span = np.maximum(node[:, -1] - node[:, 0], 1.0)[:, None]
+        d = (uniq[:, None] - node) / span
+        exact = d == 0
+        d[exact] = 1.0
+        b = w / d
+        b /= b.sum(axis=1)[:, None]
+        hit = exact.any(axis=1)
+        b[hit] = exact[hit]
+        outside = (uniq < self.times[0]) | (uniq > self.times[-1])
+        b[outside] = np.nan
+        return start[inverse], b[inverse]
+
+    def positions(self, system, prn, t):
+        """
+        Return (xyz, clock) for arrays (or scalars) of *prn* and GPS seconds
+        *t* of *system*: ECEF positions (n, 3) in meters, interpolated with a
+        Lagrange polynomial, and clock offsets in seconds, interpolated
+        linearly. NaN outside the file or for absent satellites.
+        """
+        prn, t = np.broadcast_arrays(np.asarray(prn), np.asarray(t, dtype=np.float64))
+        prn = prn.ravel()
+        t = t.ravel()
+        xyz = np.full((len(t), 3), np.nan)
+        clock = np.full(len(t), np.nan)
+        col = self.columns(system, prn)
+        ok = col >= 0
+        if not ok.any() or len(self.times) < 2:
+            return xyz, clock
+        t = t[ok]
+        col = col[ok]
+        start, b = self.basis(t)
+        n = b.shape[1]
+        node = start[:, None] + np.arange(n)
+        xyz[ok] = (b[:, :, None]*self.xyz[node, col[:, None]]).sum(axis=1)
+        i = np.clip(np.searchsorted(self.times, t) - 1, 0, len(self.times) - 2)
+        f = (t - self.times[i]) / (self.times[i + 1] - self.times[i])
+        c = self.clock[i, col]*(1.0 - f) + self.clock[i + 1, col]*f
+        c[(f < 0) | (f > 1)] = np.nan
+        clock[ok] = c
+        return xyz, clock
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Regression check of the shared directory of the ObservationCache: copies
+caught half removed by another process and their clean-up.
+
+Run this module as a script (python tests/cachecheck.py); it exits with
+status 1 when a check fails.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import ObservationCache, STALE_SECONDS
+
+OBS_HEADER = [
+    '     3.02           OBSERVATION DATA    M (MIXED)           RINEX VERSION / TYPE',
+    'TEST                                                        MARKER NAME         ',
+    '  4027881.3480   306998.7260  4919498.7320                  APPROX POSITION XYZ ',
+    'G    4 C1C L1C D1C S1C                                      SYS / # / OBS TYPES ',
+    'E    2 C1C L1C                                              SYS / # / OBS TYPES ',
+    'R    2 C1C L1C                                              SYS / # / OBS TYPES ',
+    '    30.000                                                  INTERVAL            ',
+    '  2013    10     8     0     0    0.0000000     GPS         TIME OF FIRST OBS   ',
+    '                                                            END OF HEADER       ',
+    ]
+
+# (satellite, number of observation types) of every epoch.
+SATELLITES = [ ('E11', 2), ('G05', 4), ('G12', 4), ('R03', 2) ]
+EPOCHS = 4
+
+SYSTEMS = [ 'E', 'G', 'R' ]
+
+def _observationFile(directory):
+    """
+    Write a small mixed observation file in *directory*; return its path.
+    """
+    lines = list(OBS_HEADER)
+    for e in range(EPOCHS):
+        lines.append('> 2013 10 08 00 %02d %02d.0000000  0%3d' %
+                     (e*30 // 60, e*30 % 60, len(SATELLITES)))
+        for sat, n in SATELLITES:
+            lines.append(sat + ''.join([ '%14.3f  ' % (2e7 + 10*e + i)
+                                         for i in range(n) ]))
+    path = os.path.join(directory, 'test.rnx')
+    f = open(path, 'w')
+    try:
+        f.write('\n'.join(lines) + '\n')
+    finally:
+        f.close()
+    return path
+
+def _copies(shared):
+    """
+    Return the published copies in directory *shared*.
+    """
+    return [ os.path.join(shared, n) for n in os.listdir(shared)
+             if not n.startswith('.') ]
+
+def checkPartialCopy(root):
+    """
+    Return the list of failed checks of a copy missing one of its files.
+    """
+    failed = [ ]
+    path = _observationFile(root)
+    shared = os.path.join(root, 'shared')
+    obs = ObservationCache(shared_dir=shared).get(path)
+    if sorted(obs.arrays.keys()) != SYSTEMS:
+        failed.append('published copy holds %s' % sorted(obs.arrays.keys()))
+    copy = _copies(shared)[0]
+    os.remove(os.path.join(copy, 'G.time.npy'))
+    obs = ObservationCache(shared_dir=shared).get(path)
+    if sorted(obs.arrays.keys()) != SYSTEMS:
+        failed.append('partial shared copy taken as complete: %s' %
+                      sorted(obs.arrays.keys()))
+    elif len(obs.getArrays()['G']) != 2*EPOCHS:
+        failed.append('partial shared copy gave %d GPS rows' %
+                      len(obs.getArrays()['G']))
+    return failed
+
+def checkFailedPublish(root):
+    """
+    Return the list of failed checks of a publish failing on a full file
+    system and of the removal of entries left over by failed processes.
+    """
+    failed = [ ]
+    path = _observationFile(root)
+    shared = os.path.join(root, 'shared')
+    cache = ObservationCache(shared_dir=shared)
+    def full(*args, **kwargs):
+        raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+    save = np.save
+    np.save = full
+    try:
+        cache.get(path)
+        failed.append('failed publish not reported')
+    except IOError:
+        pass
+    finally:
+        np.save = save
+    if os.listdir(shared):
+        failed.append('failed publish left %s' % os.listdir(shared))
+    stale = os.path.join(shared, '.tmp-stale')
+    os.mkdir(stale)
+    old = time.time() - 2*STALE_SECONDS
+    os.utime(stale, (old, old))
+    recent = os.path.join(shared, '.tmp-recent')
+    os.mkdir(recent)
+    cache.get(path)
+    if os.path.exists(stale):
+        failed.append('stale temporary directory not removed')
+    if not os.path.exists(recent):
+        failed.append('temporary directory in use removed')
+    if len(_copies(shared)) != 1:
+        failed.append('%d copies published' % len(_copies(shared)))
+    return failed
+
+def check():
+    """
+    Run all checks; return the list of failures.
+    """
+    failed = [ ]
+    for c in (checkPartialCopy, checkFailedPublish):
+        root = tempfile.mkdtemp()
+        try:
+            failed += c(root)
+        finally:
+            shutil.rmtree(root, True)
+    return failed
+
+if __name__ == '__main__':
+    failed = check()
+    for l in failed:
+        print(l)
+    if not failed:
+        print('All cache checks passed.')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Regression check of the orbit code: broadcast ephemerides (Kepler, BeiDou
+GEO, GLONASS integration), their time systems and SP3 interpolation.
+
+The reference positions were computed once with an independent scalar
+implementation of the interface control document formulas (GLONASS
+integrated with 1 s steps). Run this module as a script
+(python tests/orbitcheck.py); it exits with status 1 when a check fails.
+"""
+__author__ = 'Costin Gamenț'
+__email__ = 'costin.gament@gmail.com'
+__license__ = 'GPL'
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epoch import Epoch
+from rinexnav import RinexNavigation, BDT_OFFSET
+from sp3 import SP3
+
+NAV_HEADER = [
+    '     3.02           N: GNSS NAV DATA    M: MIXED            RINEX VERSION / TYPE',
+    '    16                                                      LEAP SECONDS        ',
+    '                                                            END OF HEADER       ',
+    ]
+
+NAV_RECORDS = """\
+G05 2013 10 08 02 00 00 1.000000000000D-05 1.000000000000D-12 0.000000000000D+00
+     5.000000000000D+01 4.000000000000D+01 4.500000000000D-09 3.000000000000D-01
+     1.000000000000D-06 1.000000000000D-02 8.000000000000D-06 5.153600000000D+03
+     1.800000000000D+05 1.000000000000D-07 1.000000000000D+00-1.000000000000D-07
+     9.600000000000D-01 2.000000000000D+02 5.000000000000D-01-8.000000000000D-09
+     1.000000000000D-10 1.000000000000D+00 1.761000000000D+03 0.000000000000D+00
+     2.000000000000D+00 0.000000000000D+00-1.000000000000D-08 5.000000000000D+01
+     1.700000000000D+05 4.000000000000D+00
+E11 2013 10 08 02 00 00-3.000000000000D-04-2.000000000000D-12 0.000000000000D+00
+     5.000000000000D+01 4.000000000000D+01 4.500000000000D-09 1.200000000000D+00
+     1.000000000000D-06 3.000000000000D-04 8.000000000000D-06 5.440600000000D+03
+     1.800000000000D+05 1.000000000000D-07-2.000000000000D+00-1.000000000000D-07
+     9.700000000000D-01 2.000000000000D+02-6.000000000000D-01-8.000000000000D-09
+     1.000000000000D-10 1.000000000000D+00 1.761000000000D+03 0.000000000000D+00
+     2.000000000000D+00 0.000000000000D+00-1.000000000000D-08 5.000000000000D+01
+     1.700000000000D+05 4.000000000000D+00
+C01 2013 10 08 02 00 00 2.000000000000D-04 4.000000000000D-11 0.000000000000D+00
+     5.000000000000D+01 4.000000000000D+01 4.500000000000D-09 1.000000000000D+00
+     1.000000000000D-06 5.000000000000D-04 8.000000000000D-06 6.493400000000D+03
+     1.800000000000D+05 1.000000000000D-07 2.000000000000D+00-1.000000000000D-07
+     5.000000000000D-02 2.000000000000D+02 5.000000000000D-01-8.000000000000D-09
+     1.000000000000D-10 1.000000000000D+00 4.050000000000D+02 0.000000000000D+00
+     2.000000000000D+00 0.000000000000D+00-1.000000000000D-08 5.000000000000D+01
+     1.700000000000D+05 4.000000000000D+00
+C11 2013 10 08 02 00 00-5.000000000000D-04 1.000000000000D-11 0.000000000000D+00
+     5.000000000000D+01 4.000000000000D+01 4.500000000000D-09-2.500000000000D+00
+     1.000000000000D-06 2.000000000000D-03 8.000000000000D-06 5.282600000000D+03
+     1.800000000000D+05 1.000000000000D-07-1.000000000000D+00-1.000000000000D-07
+     9.600000000000D-01 2.000000000000D+02 2.000000000000D-01-8.000000000000D-09
+     1.000000000000D-10 1.000000000000D+00 4.050000000000D+02 0.000000000000D+00
+     2.000000000000D+00 0.000000000000D+00-1.000000000000D-08 5.000000000000D+01
+     1.700000000000D+05 4.000000000000D+00
+R03 2013 10 08 01 45 00 1.000000000000D-05 1.000000000000D-12 0.000000000000D+00
+     1.000000000000D+04 1.500000000000D+00 0.000000000000D+00 0.000000000000D+00
+     2.000000000000D+04-1.000000000000D+00 0.000000000000D+00 5.000000000000D+00
+     1.000000000000D+04 2.500000000000D+00 0.000000000000D+00 0.000000000000D+00
+"""
+
+# (system, prn, GPS seconds, x, y, z (m), clock (s)) for the records above:
+# G05 and E11 Keplerian, C01 BeiDou GEO and C11 BeiDou MEO (epochs in BDT),
+# R03 GLONASS (epoch in UTC, 16 leap seconds).
+NAV_REFERENCE = [
+    ('G', 5, 1065233700.0, 9986280.9519, 17027079.5693, 17407760.9974, 9.991240881191739e-06),
+    ('E', 11, 1065231000.0, -16769263.0312, -22666424.0449, 8994932.5159, -2.999970010533563e-04),
+    ('C', 1, 1065234014.0, -41278915.5460, 8168706.4066, 2510873.5984, 2.000467224563187e-04),
+    ('C', 11, 1065234014.0, -12311276.4036, 16052330.3399, -19278366.3135, -4.999846240404843e-04),
+    ('R', 3, 1065232816.0, 11190790.8337, 18850176.6632, 12135234.8980, 1.000090000000000e-05),
+    ]
+
+# Largest accepted differences: position (m) and clock (s).
+POSITION_TOLERANCE = 0.001
+CLOCK_TOLERANCE = 1e-13
+
+# Eleven 5 minute epochs of one satellite.
+SP3_LINES = """\
+#dP2013 10  8  0  0  0.00000000      11 ORBIT IGS08 HLM  IGS
+## 1761 172800.00000000   300.00000000 56573 0.0000000000000
++    1   G05  0  0  0  0  0  0  0  0  0  0  0  0  0  0  0  0
+%c G  cc GPS ccc cccc cccc cccc cccc ccccc ccccc ccccc ccccc
+*  2013 10  8  0  0  0.00000000
+PG05  17724.966912  18688.597382  -5636.027491     10.008526
+*  2013 10  8  0  5  0.00000000
+PG05  17760.789218  18900.343545  -4703.288161     10.008077
+*  2013 10  8  0 10  0.00000000
+PG05  17778.945518  19082.927493  -3761.335142     10.007599
+*  2013 10  8  0 15  0.00000000
+PG05  17778.113981  19236.848982  -2812.007430     10.007093
+*  2013 10  8  0 20  0.00000000
+PG05  17757.026549  19362.708084  -1857.161900     10.006561
+*  2013 10  8  0 25  0.00000000
+PG05  17714.475302  19461.202045   -898.669445     10.006004
+*  2013 10  8  0 30  0.00000000
+PG05  17649.318566  19533.121714     61.588948     10.005424
+*  2013 10  8  0 35  0.00000000
+PG05  17560.486754  19579.347541   1021.726150     10.004823
+*  2013 10  8  0 40  0.00000000
+PG05  17446.987900  19600.845169   1979.852894     10.004202
+*  2013 10  8  0 45  0.00000000
+PG05  17307.912869  19598.660647   2934.081795     10.003564
+*  2013 10  8  0 50  0.00000000
+PG05  17142.440200  19573.915271   3882.531384     10.002910
+EOF
+"""
+
+# Largest accepted error (m) of the interpolation at a left out node.
+INTERPOLATION_TOLERANCE = 0.01
+
+def _navigation():
+    """
+    Return the RinexNavigation of NAV_RECORDS, read through a file.
+    """
+    fd, path = tempfile.mkstemp(suffix='.nav')
+    try:
+        f = os.fdopen(fd, 'w')
+        f.write('\n'.join(NAV_HEADER) + '\n' + NAV_RECORDS)
+        f.close()
+        return RinexNavigation(path)
+    finally:
+        os.remove(path)
+
+def checkNavigation():
+    """
+    Return the list of failed broadcast orbit checks.
+    """
+    failed = [ ]
+    nav = _navigation()
+    for s, prn, t, x, y, z, clock in NAV_REFERENCE:
+        xyz, clk = nav.positions(s, prn, t)
+        d = np.sqrt(((xyz[0] - (x, y, z))**2).sum())
+        if not d <= POSITION_TOLERANCE:
+            failed.append('%s%02d position off by %.4f m' % (s, prn, d))
+        if not abs(clk[0] - clock) <= CLOCK_TOLERANCE:
+            failed.append('%s%02d clock off by %.3e s' % (s, prn, clk[0] - clock))
+    glo = nav.ephemerides['R'][0]
+    if glo['toe'] != Epoch(2013, 10, 8, 1, 45, 0).GPSSeconds() + 16:
+        failed.append('GLONASS reference epoch not shifted by the leap seconds')
+    bds = nav.ephemerides['C'][0]
+    if bds['toc'] != Epoch(2013, 10, 8, 2, 0, 0).GPSSeconds() + 14 or \
+            bds['toe'] != 405*604800 + 180000 + BDT_OFFSET:
+        failed.append('BeiDou epochs not converted from BDT')
+    return failed
+
+def checkSP3():
+    """
+    Return the list of failed SP3 checks.
+    """
+    failed = [ ]
+    lines = SP3_LINES.split('\n')
+    full = SP3()
+    full._read(lines)
+    # a node is reproduced exactly
+    xyz, clock = full.positions('G', 5, full.times[3])
+    if not np.array_equal(xyz[0], full.xyz[3, 0]) or clock[0] != full.clock[3, 0]:
+        failed.append('SP3 node not reproduced')
+    # a left out node is interpolated from the others
+    i = lines.index('*  2013 10  8  0 25  0.00000000')
+    partial = SP3()
+    partial._read(lines[:i] + lines[i + 2:])
+    xyz, clock = partial.positions('G', 5, full.times[5])
+    d = np.sqrt(((xyz[0] - full.xyz[5, 0])**2).sum())
+    if not d <= INTERPOLATION_TOLERANCE:
+        failed.append('SP3 interpolation off by %.4f m' % d)
+    if not abs(clock[0] - full.clock[5, 0]) <= 1e-9:
+        failed.append('SP3 clock interpolation off by %.3e s' %
+                      (clock[0] - full.clock[5, 0]))
+    # time systems
+    bdt = SP3()
+    bdt._read([ l.replace(' GPS ', ' BDT ') for l in lines ])
+    if not (bdt.times - full.times == 14.0).all():
+        failed.append('SP3 BDT epochs not converted to GPS time')
+    glo = SP3()
+    glo._read([ l.replace(' GPS ', ' GLO ') for l in lines ])
+    if not (glo.times - full.times == 16.0 - 10800.0).all():
+        failed.append('SP3 GLO epochs not converted to GPS time')
+    try:
+        SP3()._read([ l.replace(' GPS ', ' XYZ ') for l in lines ])
+        failed.append('unknown SP3 time system accepted')
+    except ValueError:
+        pass
+    return failed
+
+def check():
+    """
+    Run all checks; return the list of failures.
+    """
+    return checkNavigation() + checkSP3()
+
+if __name__ == '__main__':
+    failed = check()
+    for l in failed:
+        print(l)
+    if not failed:
+        print('All orbit checks passed.')
+    sys.exit(1 if failed else 0)